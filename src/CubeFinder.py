@@ -7,11 +7,19 @@ Cube finding program.
 
 from __future__ import division  # so 1/2 returns 0.5 instead of 0
 from rotation import *
+import argparse
+import association
+import capture
+import circuit
 import cv2
 import cube
 import geom
 import imag
+import math
+import motion
 import numpy as np
+import recording
+import simulator
 from gates import QuantumOperation
 
 
@@ -122,37 +130,129 @@ def draw_pose(pose_measurement, draw_frame):
     cv2.drawContours(draw_frame, [scale_around(ordered_corners, 0.5, mid)], 0, (0, 255, 255), 1)
 
 
+# Extra space, in pixels, left around a tracked face's predicted position when searching for it.
+SEARCH_MARGIN = 5
+
+
 class TrackSquare(object):
     """
     An area corresponding to a qubit. Tracks checkerboard cube within for operations to apply.
     """
-    def __init__(self, x, y, w, h):
+    def __init__(self, x, y, w, h, bank=None, index=0):
+        """
+        :param bank: The cube.PoseTrackBank holding this area's pose track, shared with other areas so they can all be
+        advanced together, or None to give this area a bank of its own.
+        :param index: The index of this area's track within the bank.
+        """
         self.x = x
         self.y = y
         self.w = w
         self.h = h
-        self.track = cube.PoseTrack.Empty
+        self.bank = cube.PoseTrackBank(1) if bank is None else bank
+        self.index = index
         self.is_tracking = False
-        self.is_controlled = False
         self.op = Rotation().as_pauli_operation()
+        self.op_version = None
+        self.motion = None
+        self.matched_area = None
+
+    @property
+    def track(self):
+        return self.bank.view(self.index)
+
+    @property
+    def is_controlled(self):
+        return bool(self.bank.controls[self.index])
 
-    def update(self, pose_measurements):
+    @is_controlled.setter
+    def is_controlled(self, value):
+        self.bank.controls[self.index] = value
+
+    def association_query(self):
         """
-        Performs tracking using the new set of pose measurements.
-        Updates this area's track using the single measurement in the tracking area (or else does nothing).
+        Describes where this area expects its face to be found, for assigning measurements to tracking areas.
 
-        :param pose_measurements: Probable checkerboard cube face locations.
+        >>> query = TrackSquare(0, 0, 100, 50).association_query()
+        >>> query.window, query.center, query.side_index
+        ((0, 0, 100, 50), (50.0, 25.0), None)
         """
-        matching = [pose_measurement for pose_measurement in pose_measurements
-                    if self.x <= pose_measurement.center[0] <= self.x + self.w
-                    if self.y <= pose_measurement.center[1] <= self.y + self.h]
-        self.op = unitary_lerp(self.op, self.track.quantum_operation(), 0.5)
-        self.is_tracking = len(matching) == 1
-        if self.is_tracking:
-            matched_pose = matching[0]
-            self.track = self.track.then(matched_pose)
-            if self.track.stable_pose_measurement == matched_pose:
-                self.is_controlled = matched_pose.center[1] >= self.y + self.h / 2
+        if self.motion is None:
+            return association.TrackQuery(self.search_window(),
+                                          (self.x + self.w / 2, self.y + self.h / 2),
+                                          math.hypot(self.w, self.h) / 2)
+        return association.TrackQuery(self.search_window(),
+                                      self.motion.center(),
+                                      self.motion.gating_radius(),
+                                      self.track.facing.current_front.index,
+                                      self.matched_area)
+
+    def update(self, pose_measurement, area=None):
+        """
+        Performs tracking using the measurement assigned to this area in the latest frame, if any. Keeps tracking, on
+        the predicted motion alone, through a few frames where the face isn't found. The motion prediction should
+        already have been advanced to the latest frame. predict_track_squares and update_track_squares do all this for
+        many areas at once.
+
+        :param pose_measurement: The cube.PoseMeasurement assigned to this area, or None.
+        :param area: The area of the measured face, if known.
+
+        >>> square = TrackSquare(0, 0, 10, 10)
+        >>> square.update(None)
+        >>> square.op_version == square.track.operation_version
+        True
+        """
+        if pose_measurement is None:
+            update_assigned_track_squares([self], cube.FramePoseMeasurements.Empty, [None], [])
+        else:
+            update_assigned_track_squares([self],
+                                          cube.FramePoseMeasurements.from_pose_measurements([pose_measurement]),
+                                          [0],
+                                          [area])
+
+    def smooth_op(self):
+        """
+        Moves the displayed operation towards the tracked operation, until close enough to just show it.
+        """
+        smooth_track_square_ops([self])
+
+    def follow(self, pose_measurement, area):
+        """
+        Updates this area's motion prediction with the measurement assigned to it, if any.
+        """
+        if pose_measurement is None:
+            if self.motion is not None:
+                self.motion.miss()
+                if self.motion.is_lost():
+                    self.motion = None
+            self.is_tracking = self.motion is not None
+            return
+
+        self.is_tracking = True
+        self.matched_area = area
+        if self.motion is None:
+            self.motion = motion.MotionModel(pose_measurement.center, pose_measurement.angle)
+        else:
+            self.motion.update(pose_measurement.center, pose_measurement.angle)
+
+    def search_window(self):
+        """
+        Returns the (x, y, w, h) part of this area where the tracked face is expected to be found next. That's the whole
+        area when nothing is being tracked.
+
+        >>> square = TrackSquare(0, 0, 100, 100)
+        >>> square.search_window()
+        (0, 0, 100, 100)
+        >>> square.motion = motion.MotionModel((90, 50), 0)
+        >>> x, y, w, h = square.search_window()
+        >>> 70 < x < 90, x + w, 30 < y < 50, 50 < y + h < 70
+        (True, 100.0, True, True)
+        """
+        if self.motion is None:
+            return self.x, self.y, self.w, self.h
+        x, y, w, h = self.motion.search_window(SEARCH_MARGIN)
+        x1, y1 = max(x, self.x), max(y, self.y)
+        x2, y2 = min(x + w, self.x + self.w), min(y + h, self.y + self.h)
+        return x1, y1, max(0, x2 - x1), max(0, y2 - y1)
 
     def draw(self, draw_frame, qubit_size):
         """
@@ -175,6 +275,112 @@ class TrackSquare(object):
                       1)
 
 
+def predict_track_squares(tracks):
+    """
+    Advances every tracking area's motion prediction to the upcoming frame. Done before searching the frame, so the
+    search windows follow faces that are moving.
+
+    :param tracks: The list of TrackSquare instances.
+
+    >>> square = TrackSquare(0, 0, 200, 100)
+    >>> square.motion = motion.MotionModel((50, 50), 0)
+    >>> for x in [65, 80, 95]:
+    ...     predict_track_squares([square])
+    ...     square.motion.update((x, 50), 0)
+    >>> predict_track_squares([square])
+    >>> x, y, w, h = square.search_window()
+    >>> x < 110 < x + w
+    True
+    """
+    for t in tracks:
+        if t.motion is not None:
+            t.motion.predict()
+
+
+def update_track_squares(tracks, pose_measurements, timestamp=None):
+    """
+    Assigns the frame's measurements to the tracking areas, and updates them. The areas' motion predictions should
+    already have been advanced to the frame, with predict_track_squares. Rotations of the tracked cubes are published
+    to the areas' track banks' event streams.
+
+    :param tracks: The list of TrackSquare instances.
+    :param pose_measurements: The frame's cube.FramePoseMeasurements.
+    :param timestamp: When the frame was captured.
+
+    >>> tracks = make_track_squares()
+    >>> poses = cube.FramePoseMeasurements([(40, 60)], [[(30, 50), (50, 50), (50, 70), (30, 70)]], [0], [1], [False], \
+                                           np.zeros((1, 2, 3)))
+    >>> update_track_squares(tracks, poses)
+    >>> [t.is_tracking for t in tracks], tracks[0].matched_area
+    ([True, False, False, False], 400.0)
+    """
+    assigned = association.assign([t.association_query() for t in tracks], pose_measurements)
+    update_assigned_track_squares(tracks, pose_measurements, assigned, pose_measurements.areas(), timestamp)
+
+
+def smooth_track_square_ops(tracks):
+    """
+    Moves the displayed operations of tracking areas towards their tracked operations, interpolating all of them at
+    once. See TrackSquare.smooth_op.
+
+    :param tracks: The list of TrackSquare instances.
+
+    >>> tracks = make_track_squares(2)
+    >>> tracks[1].track.rotations = [Rotation(x=0.5)]
+    >>> smooth_track_square_ops(tracks)
+    >>> np.allclose(tracks[1].op, Rotation(x=0.25).as_pauli_operation()), tracks[0].op_version
+    (True, 0)
+    """
+    moving = [t for t in tracks if t.op_version != t.track.operation_version]
+    if len(moving) == 0:
+        return
+    versions = [t.track.operation_version for t in moving]
+    targets = [t.track.quantum_operation() for t in moving]
+    ops = unitary_lerps([t.op for t in moving], targets, [0.5])[:, 0]
+    for t, op, target, version in zip(moving, ops, targets, versions):
+        t.op = np.mat(op)
+        if np.max(np.abs(t.op - target)) < 0.001:
+            t.op = target
+            t.op_version = version
+
+
+def update_assigned_track_squares(tracks, pose_measurements, assigned, areas, timestamp=None):
+    """
+    Updates tracking areas with the measurements assigned to them, advancing the pose tracks of areas sharing a
+    cube.PoseTrackBank in one batched step.
+
+    :param tracks: The list of TrackSquare instances.
+    :param pose_measurements: The frame's cube.FramePoseMeasurements.
+    :param assigned: For each area, the index of its assigned measurement or None.
+    :param areas: The area of each measured face.
+    :param timestamp: When the frame was captured.
+    """
+    smooth_track_square_ops(tracks)
+
+    banks = {}
+    for k in range(len(tracks)):
+        if assigned[k] is not None:
+            banks.setdefault(id(tracks[k].bank), []).append(k)
+    for ks in banks.values():
+        bank = tracks[ks[0]].bank
+        measurement_indices = [assigned[k] for k in ks]
+
+        # areas are controlled by cubes held in their bottom half
+        centers_y = pose_measurements.centers[measurement_indices, 1]
+        mid_lines = np.array([tracks[k].y + tracks[k].h / 2 for k in ks])
+        bank.then([tracks[k].index for k in ks],
+                  pose_measurements,
+                  measurement_indices,
+                  controlled=centers_y >= mid_lines,
+                  timestamp=timestamp)
+
+    for t, m in zip(tracks, assigned):
+        if m is None:
+            t.follow(None, None)
+        else:
+            t.follow(pose_measurements[m], areas[m])
+
+
 def draw_state(draw_frame, state):
     x = 0
     y = 0
@@ -184,9 +390,9 @@ def draw_state(draw_frame, state):
     area_border_color = (0, 255, 255)
     phase_line_color = (0, 255, 0)
 
-    state = state.tolist()
+    state = np.asarray(state).reshape(-1).tolist()
     for i in range(len(state)):
-        c = complex(state[i][0])
+        c = complex(state[i])
         dx = i % 4
         dy = i // 4
         p = (x + r + d * dx, y + r + d * dy)
@@ -207,77 +413,91 @@ def draw_state(draw_frame, state):
     #               1)
 
 
-def run_loop():
+def make_track_squares(count=4):
     """
-    Read frame, process frame, repeat.
+    Returns the row of qubit tracking areas used by the cube finding program.
+
+    :param count: The number of qubits. The areas' pose tracks share a cube.PoseTrackBank.
+
+    >>> [(t.x, t.y, t.w, t.h) for t in make_track_squares(2)]
+    [(1, 50, 73, 100), (76, 50, 73, 100)]
     """
     margin = 1
     size = 75
-    tracks = [TrackSquare(margin + size*i, 50, size - margin*2, 100) for i in range(4)]
+    bank = cube.PoseTrackBank(count)
+    return [TrackSquare(margin + size*i, 50, size - margin*2, 100, bank, i) for i in range(count)]
+
+
+def run_loop(record_path=None):
+    """
+    Read frame, process frame, repeat.
+
+    :param record_path: A directory to record the processed frames and their pose measurements into, or None to not
+    record anything.
+    """
+    tracks = make_track_squares()
+    rotation_events = tracks[0].bank.events.subscribe()
 
-    capture = cv2.VideoCapture(0)
-    if not capture.isOpened():
-        raise RuntimeError("Failed to open video capture.")
+    # Ask the camera for frames at the size we process, instead of shrinking large frames ourselves
+    source = capture.PrefetchingFrameSource(capture.CameraFrameSource(0), buffer_size=1, drop_when_full=True)
+    recorder = None if record_path is None else recording.RecordingWriter(record_path, source.size)
 
     operations_in_progress = []
     all_operations = []
-    no_op = QuantumOperation(Rotation().as_pauli_operation(),
-                             [None, False, False, False]).full_operation()
-    no_state = np.mat([[1], [0], [0], [0],
-                       [0], [0], [0], [0],
-                       [0], [0], [0], [0],
-                       [0], [0], [0], [0]])
-    accumulated_operation = no_op
+    committed = circuit.Circuit(len(tracks))
 
     while True:
         # Read next frame
-        _, frame = capture.read()
+        captured = source.read()
+        if captured is None:
+            break
+        frame = captured.image
         h, w = frame.shape[:2]
 
-        # Shrink and mirror
-        reduction = 12
-        h, w = (h // reduction)*2, (w // reduction)*2
-        frame = cv2.resize(frame, (w, h))
-
         draw_frame = np.copy(frame)
-        frame_pose_measurements = imag.find_checkerboard_cube_faces(frame, draw_frame)
+        predict_track_squares(tracks)
+        frame_pose_measurements = imag.find_checkerboard_cube_faces(frame,
+                                                                    draw_frame,
+                                                                    [t.search_window() for t in tracks])
+        if recorder is not None:
+            recorder.append(frame, captured.timestamp, frame_pose_measurements)
         for pose in frame_pose_measurements:
             draw_pose(pose, draw_frame)
+        update_track_squares(tracks, frame_pose_measurements, captured.timestamp)
         for tracked in tracks:
-            tracked.update(frame_pose_measurements)
             tracked.draw(draw_frame, 5)
 
-        for i in range(len(tracks)):
-            t = tracks[i]
-            for r in t.track.rotations:
-                op = QuantumOperation(
-                    r.as_pauli_operation(),
-                    [None if i == j else tracks[j].is_controlled for j in range(len(tracks))])
-                print op.__repr__()
-                print op.__str__()
-                operations_in_progress.append([op, 0])
-                all_operations.append(op)
-                print QuantumOperation.quantum_circuit_str(all_operations)
-            t.track.rotations = []
+        for event in rotation_events.drain():
+            op = QuantumOperation(event.rotation.as_pauli_operation(), event.controls)
+            print op.__str__()
+            operations_in_progress.append([op, 0])
+            all_operations.append(op)
+            print circuit.moments_str(circuit.moments(all_operations))
 
         for p in operations_in_progress:
             p[1] += 0.125
         while len(operations_in_progress) > 0 and operations_in_progress[0][1] >= 1:
-            accumulated_operation = operations_in_progress[0][0].full_operation() * accumulated_operation
+            committed.append(operations_in_progress[0][0])
             operations_in_progress.remove(operations_in_progress[0])
 
-        progress = reduce(lambda a, e: e * a,
-                          [r[0].interpolated_operation(r[1]) for r in operations_in_progress],
-                          accumulated_operation)
+        progress = np.copy(committed.state())
+        for op, t in operations_in_progress:
+            simulator.apply_operation(progress, op.interpolated(t))
         draw_frame = cv2.resize(draw_frame, (w*3, h*3))
-        draw_state(draw_frame, progress * no_state)
+        draw_state(draw_frame, progress)
 
         cv2.imshow('debug', draw_frame)
 
-        if cv2.waitKey(1) == 27 or capture is None:
+        if cv2.waitKey(1) == 27:
             break
 
     cv2.destroyAllWindows()
-    capture.release()
-
-run_loop()
+    source.release()
+    if recorder is not None:
+        recorder.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tracks checkerboard cubes to control a simulated quantum computer.")
+    parser.add_argument('--record', metavar='DIR', default=None,
+                        help="record processed frames and pose measurements into a directory, for later replay")
+    run_loop(record_path=parser.parse_args().record)
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Assigns each frame's pose measurements to the tracks following them.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import math
+import numpy as np
+
+
+# How much assignment cost is added for a measured front side that is opposite the tracked one (a half turn in one
+# frame is implausible), and per unit of log area ratio between the measured and last matched face.
+OPPOSITE_SIDE_COST = 1.0
+AREA_COST = 0.5
+
+DEFAULT_CELL_SIZE = 32
+
+
+class GridIndex(object):
+    """
+    Buckets points into a uniform grid, so the points within an area can be found without checking every point.
+    """
+
+    def __init__(self, points, cell_size=DEFAULT_CELL_SIZE):
+        """
+        :param points: An (N, 2) array of (x, y) points.
+        :param cell_size: The width and height of the grid cells.
+        """
+        self.points = np.asarray(points, np.float64).reshape((-1, 2))
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, cell in enumerate(np.floor(self.points / cell_size).astype(np.int64).tolist()):
+            self.cells.setdefault(tuple(cell), []).append(i)
+
+    def in_rect(self, x, y, w, h):
+        """
+        Returns the indices of the points within the given rectangle, edges included, in increasing order.
+
+        >>> GridIndex([(1, 1), (50, 50), (2, 3), (40, 2)], cell_size=10).in_rect(0, 0, 3, 3)
+        [0, 2]
+        """
+        c = self.cell_size
+        found = []
+        for cx in range(int(math.floor(x / c)), int(math.floor((x + w) / c)) + 1):
+            for cy in range(int(math.floor(y / c)), int(math.floor((y + h) / c)) + 1):
+                for i in self.cells.get((cx, cy), []):
+                    px, py = self.points[i]
+                    if x <= px <= x + w and y <= py <= y + h:
+                        found.append(i)
+        return sorted(found)
+
+
+class TrackQuery(object):
+    """
+    What the association step needs to know about a track: where its face may be, and what it should look like.
+    """
+
+    def __init__(self, window, center, radius, side_index=None, area=None):
+        """
+        :param window: The (x, y, w, h) area the face's center must be within.
+        :param center: The (x, y) position the face's center is expected at.
+        :param radius: How far from the expected position the face's center can plausibly be.
+        :param side_index: The side index of the front side being tracked, or None if not known.
+        :param area: The area of the last matched face, or None if not known.
+        """
+        self.window = window
+        self.center = center
+        self.radius = radius
+        self.side_index = side_index
+        self.area = area
+
+
+def assignment_cost(query, center, side_index, area):
+    """
+    Scores how poorly a measurement matches a track. Lower is better.
+
+    :param query: The track's TrackQuery.
+    :param center: The measured (x, y) center.
+    :param side_index: The measured front side index.
+    :param area: The measured face area.
+
+    >>> q = TrackQuery((0, 0, 100, 100), (50, 50), 10, side_index=0, area=100)
+    >>> assignment_cost(q, (50, 55), 0, 100)
+    0.5
+    >>> assignment_cost(q, (50, 55), 3, 100)
+    1.5
+    >>> round(assignment_cost(q, (50, 55), 1, 100 * math.e), 6)
+    1.0
+    """
+    cost = math.hypot(center[0] - query.center[0], center[1] - query.center[1]) / max(query.radius, 0.000001)
+    if query.side_index is not None and side_index == (query.side_index + 3) % 6:
+        cost += OPPOSITE_SIDE_COST
+    if query.area is not None and query.area > 0 and area > 0:
+        cost += AREA_COST * abs(math.log(area / query.area))
+    return cost
+
+
+def assign(queries, pose_measurements, cell_size=DEFAULT_CELL_SIZE):
+    """
+    Greedily pairs tracks with measurements, cheapest pairs first, each track and measurement used at most once. Only
+    measurements within a track's window and radius are considered for it.
+
+    :param queries: A TrackQuery for each track.
+    :param pose_measurements: The frame's cube.FramePoseMeasurements.
+    :param cell_size: The grid cell size used to find the measurements near each track.
+    :return: For each track, the index of its assigned measurement or None.
+
+    >>> import cube
+    >>> poses = cube.FramePoseMeasurements([(10, 10), (14, 10), (80, 80)], np.zeros((3, 4, 2)), [0, 0, 0], \
+                                           [0, 0, 0], [False] * 3, np.zeros((3, 2, 3)))
+    >>> assign([TrackQuery((0, 0, 50, 50), (15, 10), 10), \
+                TrackQuery((0, 0, 50, 50), (9, 10), 10), \
+                TrackQuery((0, 0, 50, 50), (40, 40), 10)], poses)
+    [1, 0, None]
+    """
+    if len(pose_measurements) == 0:
+        return [None] * len(queries)
+
+    grid = GridIndex(pose_measurements.centers, cell_size)
+    areas = pose_measurements.areas()
+    pairs = []
+    for t, query in enumerate(queries):
+        for m in grid.in_rect(*query.window):
+            center = grid.points[m]
+            if math.hypot(center[0] - query.center[0], center[1] - query.center[1]) > query.radius:
+                continue
+            pairs.append((assignment_cost(query, center, pose_measurements.sides[m], areas[m]), t, m))
+
+    result = [None] * len(queries)
+    used = set()
+    for _, t, m in sorted(pairs):
+        if result[t] is None and m not in used:
+            result[t] = m
+            used.add(m)
+    return result
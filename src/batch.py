@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Headless batch processing of recorded sessions. Re-runs cube face detection and pose tracking over video files and
+frame directories, spread across a process pool, and writes the measurements and emitted rotations of each input to
+compact per-input files.
+
+Usage: python batch.py [--output DIR] [--processes N] [--shard-frames N] [--warm-up N] INPUT [INPUT ...]
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import argparse
+import multiprocessing
+import os
+import numpy as np
+import capture
+import imag
+import recording
+import CubeFinder
+from recording import POSE_DTYPE, pose_records
+
+
+ROTATION_DTYPE = np.dtype([('frame', np.int32),
+                           ('timestamp', np.float64),
+                           ('track', np.int16),
+                           ('rotation', np.float64, (3,)),
+                           ('controls', np.uint32)])
+
+
+def controls_mask(controls):
+    """
+    Packs which tracks are controlling an operation into a bit mask, bit i being track i.
+
+    :param controls: The wire controls of the operation, as in an events.RotationEvent.
+
+    >>> controls_mask([True, None, False, True])
+    9
+    """
+    return sum(1 << j for j in range(len(controls)) if controls[j])
+
+
+def plan_shards(frame_count, shard_frames, warm_up):
+    """
+    Splits a sequence of frames into ranges that can be processed independently.
+
+    Each shard (start, stop, emit_start) processes the frames in [start, stop) but only reports results for frames at or
+    after emit_start. The frames before emit_start overlap the previous shard, and give the tracker a chance to reach
+    the state it would have been in had the frames been processed in one pass.
+
+    :param frame_count: The total number of frames.
+    :param shard_frames: The number of frames each shard reports results for.
+    :param warm_up: The number of overlapping frames each shard (except the first) processes before reporting results.
+
+    >>> plan_shards(10, 4, 2)
+    [(0, 4, 0), (2, 8, 4), (6, 10, 8)]
+    >>> plan_shards(3, 4, 2)
+    [(0, 3, 0)]
+    >>> plan_shards(0, 4, 2)
+    []
+    """
+    return [(max(0, s - warm_up), min(s + shard_frames, frame_count), s)
+            for s in range(0, frame_count, shard_frames)]
+
+
+def open_frame_source(path, size, start=0, stop=None):
+    """
+    Opens a recorded input, which is a video file, a directory of frame images, or a recording made by run_loop.
+
+    :param path: The video file, frame directory or recording.
+    :param size: The (w, h) size to process frames at.
+    :param start: The index of the first frame to read.
+    :param stop: The index of the frame to stop before, or None to read until the end.
+    """
+    if recording.is_recording(path):
+        return recording.RecordingFrameSource(path, size=size, start=start, stop=stop)
+    if os.path.isdir(path):
+        return capture.ImageDirectoryFrameSource(path, size=size, start=start, stop=stop)
+    return capture.VideoFileFrameSource(path, size=size, start=start, stop=stop)
+
+
+def count_frames(path):
+    """
+    Returns the number of frames in a recorded input.
+
+    :param path: The video file or frame directory.
+    """
+    source = open_frame_source(path, None)
+    try:
+        return source.frame_count()
+    finally:
+        source.release()
+
+
+def process_shard(job):
+    """
+    Runs detection and tracking over one shard of a recorded input.
+
+    :param job: A (path, (start, stop, emit_start), size) tuple.
+    :return: (path, pose records, rotation records) for the frames at or after emit_start.
+    """
+    path, (start, stop, emit_start), size = job
+    tracks = CubeFinder.make_track_squares()
+    rotation_events = tracks[0].bank.events.subscribe()
+    poses = []
+    rotations = []
+
+    source = open_frame_source(path, size, start, stop)
+    try:
+        for frame in source:
+            pose_measurements = imag.find_checkerboard_cube_faces(frame.image, np.copy(frame.image))
+            CubeFinder.predict_track_squares(tracks)
+            CubeFinder.update_track_squares(tracks, pose_measurements, frame.timestamp)
+            frame_events = rotation_events.drain()
+            if frame.index < emit_start:
+                continue
+
+            poses.append(pose_records(frame.index, frame.timestamp, pose_measurements))
+            for e in frame_events:
+                rotations.append((frame.index, e.timestamp, e.track_index, e.rotation.v, controls_mask(e.controls)))
+    finally:
+        source.release()
+
+    pose_array = np.concatenate(poses) if len(poses) > 0 else np.zeros(0, POSE_DTYPE)
+    return path, pose_array, np.array(rotations, ROTATION_DTYPE)
+
+
+def output_paths(output_dir, path):
+    """
+    Returns where the pose and rotation records of an input are written.
+
+    :param output_dir: The directory results are written into.
+    :param path: The video file or frame directory that was processed.
+
+    >>> output_paths('out', 'sessions/monday.avi')
+    ('out/monday.avi.poses.npy', 'out/monday.avi.rotations.npy')
+    """
+    name = os.path.basename(os.path.normpath(path))
+    return os.path.join(output_dir, name + '.poses.npy'), os.path.join(output_dir, name + '.rotations.npy')
+
+
+def run_batch(paths, output_dir, processes=None, shard_frames=900, warm_up=30, size=capture.DEFAULT_FRAME_SIZE):
+    """
+    Processes recorded inputs across a pool of worker processes, writing each input's results as soon as all of its
+    shards are done.
+
+    :param paths: The video files and frame directories to process.
+    :param output_dir: The directory to write results into.
+    :param processes: The number of worker processes, or None for one per core.
+    :param shard_frames: The number of frames each shard reports results for.
+    :param warm_up: The number of frames each shard re-processes from the previous shard to warm up tracking.
+    :param size: The (w, h) size to process frames at.
+    :return: A list of (path, pose count, rotation count) tuples.
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    jobs = [(path, shard, size)
+            for path in paths
+            for shard in plan_shards(count_frames(path), shard_frames, warm_up)]
+    remaining = {path: 0 for path in paths}
+    for path, _, _ in jobs:
+        remaining[path] += 1
+
+    pending = {path: ([], []) for path in paths}
+    summary = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        # imap preserves job order, so each input's shards arrive in frame order
+        for path, poses, rotations in pool.imap(process_shard, jobs):
+            pending[path][0].append(poses)
+            pending[path][1].append(rotations)
+            remaining[path] -= 1
+            if remaining[path] == 0:
+                summary.append(write_results(output_dir, path, *pending.pop(path)))
+    finally:
+        pool.close()
+        pool.join()
+
+    # inputs without any frames still get (empty) outputs
+    for path in pending:
+        summary.append(write_results(output_dir, path, *pending[path]))
+    return summary
+
+
+def write_results(output_dir, path, pose_chunks, rotation_chunks):
+    """
+    Writes the pose and rotation records of an input.
+
+    :return: (path, pose count, rotation count)
+    """
+    poses = np.concatenate(pose_chunks) if len(pose_chunks) > 0 else np.zeros(0, POSE_DTYPE)
+    rotations = np.concatenate(rotation_chunks) if len(rotation_chunks) > 0 else np.zeros(0, ROTATION_DTYPE)
+    pose_path, rotation_path = output_paths(output_dir, path)
+    np.save(pose_path, poses)
+    np.save(rotation_path, rotations)
+    return path, len(poses), len(rotations)
+
+
+def parse_size(text):
+    """
+    Parses a WxH frame size.
+
+    >>> parse_size('320x180')
+    (320, 180)
+    """
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-runs cube detection and tracking over recorded sessions.")
+    parser.add_argument('inputs', nargs='+', help="video files or directories of frame images")
+    parser.add_argument('--output', default='batch_output', help="directory to write per-input results into")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--shard-frames', type=int, default=900, help="frames reported per shard")
+    parser.add_argument('--warm-up', type=int, default=30, help="overlapping frames used to warm up tracking")
+    parser.add_argument('--size', type=parse_size, default=capture.DEFAULT_FRAME_SIZE, help="processing size, WxH")
+    args = parser.parse_args(argv)
+
+    for path, pose_count, rotation_count in run_batch(args.inputs,
+                                                      args.output,
+                                                      processes=args.processes,
+                                                      shard_frames=args.shard_frames,
+                                                      warm_up=args.warm_up,
+                                                      size=args.size):
+        print "%s: %d pose measurements, %d rotations" % (path, pose_count, rotation_count)
+
+
+if __name__ == "__main__":
+    main()
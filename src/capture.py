@@ -0,0 +1,391 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Sources of timestamped frames for the cube finding program: cameras, video files, image directories and generators.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import os
+import threading
+import time
+import Queue
+import cv2
+import numpy as np
+
+
+# The size the cube finder processes frames at (a 1920x1080 camera shrunk by a factor of 6), which the qubit tracking
+# areas laid out by run_loop are sized for.
+DEFAULT_FRAME_SIZE = (320, 180)
+DEFAULT_FRAME_RATE = 30
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+
+
+class Frame(object):
+    """
+    An image produced by a frame source, along with when it was captured.
+    """
+
+    def __init__(self, image, timestamp, index):
+        """
+        :param image: The bgr opencv image.
+        :param timestamp: When the image was captured, in seconds.
+        :param index: How many frames the source produced before this one.
+        """
+        self.image = image
+        self.timestamp = timestamp
+        self.index = index
+
+    def __str__(self):
+        """
+        >>> str(Frame(np.zeros((80, 106, 3), np.uint8), 1.5, 45))
+        'frame 45 at 1.500s (106x80)'
+        """
+        h, w = self.image.shape[:2]
+        return "frame %d at %.3fs (%dx%d)" % (self.index, self.timestamp, w, h)
+
+
+def capture_property(name):
+    """
+    Returns the opencv video capture property id with the given name (e.g. 'FRAME_WIDTH'), regardless of whether the
+    installed opencv version puts the constants on cv2 or on cv2.cv.
+
+    :param name: The property name, without the 'CAP_PROP_' prefix.
+
+    >>> capture_property('FRAME_WIDTH') == capture_property('FRAME_WIDTH')
+    True
+    >>> capture_property('FRAME_WIDTH') != capture_property('FRAME_HEIGHT')
+    True
+    """
+    if hasattr(cv2, 'CAP_PROP_' + name):
+        return getattr(cv2, 'CAP_PROP_' + name)
+    return getattr(cv2.cv, 'CV_CAP_PROP_' + name)
+
+
+def fit_to_size(image, size):
+    """
+    Resizes an image to the given size, unless it already has that size.
+
+    :param image: An opencv image.
+    :param size: The desired (w, h) size, or None to keep whatever size the image has.
+
+    >>> fit_to_size(np.zeros((4, 6, 3), np.uint8), (3, 2)).shape
+    (2, 3, 3)
+    >>> image = np.zeros((4, 6, 3), np.uint8)
+    >>> fit_to_size(image, (6, 4)) is image
+    True
+    >>> fit_to_size(image, None) is image
+    True
+    """
+    if size is None:
+        return image
+    h, w = image.shape[:2]
+    if (w, h) == tuple(size):
+        return image
+    return cv2.resize(image, tuple(size), interpolation=cv2.INTER_AREA)
+
+
+class FrameSource(object):
+    """
+    Produces a sequence of timestamped frames, all resized to a common target size.
+
+    Subclasses implement _read_image, returning (image, timestamp) or (None, None) when they run out of frames.
+    """
+
+    def __init__(self, size=None):
+        """
+        :param size: The (w, h) size frames should have, or None to keep the size the frames arrive with.
+        """
+        self.size = size
+        self._index = 0
+
+    def _read_image(self):
+        raise NotImplementedError()
+
+    def read(self):
+        """
+        Returns the next Frame, or None when there are no more frames.
+        """
+        image, timestamp = self._read_image()
+        if image is None:
+            return None
+        frame = Frame(fit_to_size(image, self.size), timestamp, self._index)
+        self._index += 1
+        return frame
+
+    def release(self):
+        """
+        Frees any devices, files or threads held by the source.
+        """
+        pass
+
+    def __iter__(self):
+        """
+        >>> [f.index for f in SyntheticFrameSource(count=3)]
+        [0, 1, 2]
+        """
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class CameraFrameSource(FrameSource):
+    """
+    Reads frames from a camera, asking the device to capture at the target size and rate so that it doesn't decode
+    (and we don't have to shrink) megapixels that are never looked at.
+    """
+
+    def __init__(self, device=0, size=DEFAULT_FRAME_SIZE, fps=DEFAULT_FRAME_RATE):
+        """
+        :param device: The opencv camera index.
+        :param size: The (w, h) size to request from the device. Frames are resized to this size if the device picks
+        a different capture mode.
+        :param fps: The frame rate to request from the device.
+        """
+        FrameSource.__init__(self, size)
+        self.capture = cv2.VideoCapture(device)
+        if not self.capture.isOpened():
+            raise RuntimeError("Failed to open video capture.")
+        if size is not None:
+            self.capture.set(capture_property('FRAME_WIDTH'), size[0])
+            self.capture.set(capture_property('FRAME_HEIGHT'), size[1])
+        if fps is not None:
+            self.capture.set(capture_property('FPS'), fps)
+
+    def negotiated_size(self):
+        """
+        Returns the (w, h) size the device actually agreed to capture at.
+        """
+        return (int(self.capture.get(capture_property('FRAME_WIDTH'))),
+                int(self.capture.get(capture_property('FRAME_HEIGHT'))))
+
+    def _read_image(self):
+        ok, image = self.capture.read()
+        timestamp = time.time()
+        if not ok:
+            return None, None
+        return image, timestamp
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileFrameSource(FrameSource):
+    """
+    Reads frames from a recorded video file, optionally restricted to a range of frame indices.
+    """
+
+    def __init__(self, path, size=None, start=0, stop=None):
+        """
+        :param path: The video file to read.
+        :param size: The (w, h) size frames should have, or None to keep the recorded size.
+        :param start: The index of the first frame to read.
+        :param stop: The index of the frame to stop before, or None to read until the end of the file.
+        """
+        FrameSource.__init__(self, size)
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise RuntimeError("Failed to open video file: " + path)
+        if start > 0:
+            self.capture.set(capture_property('POS_FRAMES'), start)
+        self._index = start
+        self.stop = stop
+
+    def frame_count(self):
+        """
+        Returns the number of frames the file claims to contain.
+        """
+        return int(self.capture.get(capture_property('FRAME_COUNT')))
+
+    def _read_image(self):
+        if self.stop is not None and self._index >= self.stop:
+            return None, None
+        ok, image = self.capture.read()
+        if not ok:
+            return None, None
+        return image, self.capture.get(capture_property('POS_MSEC')) / 1000
+
+    def release(self):
+        self.capture.release()
+
+
+def list_image_files(directory):
+    """
+    Returns the paths of the image files in a directory, in name order.
+
+    :param directory: The directory to list.
+    """
+    names = sorted(e for e in os.listdir(directory) if os.path.splitext(e)[1].lower() in IMAGE_EXTENSIONS)
+    return [os.path.join(directory, e) for e in names]
+
+
+class ImageDirectoryFrameSource(FrameSource):
+    """
+    Reads frames from a directory of image files, in name order, with timestamps derived from a nominal frame rate.
+    """
+
+    def __init__(self, directory, size=None, fps=DEFAULT_FRAME_RATE, start=0, stop=None):
+        """
+        :param directory: The directory containing the images.
+        :param size: The (w, h) size frames should have, or None to keep the stored size.
+        :param fps: The frame rate the images were captured at, used to produce timestamps.
+        :param start: The index of the first image to read.
+        :param stop: The index of the image to stop before, or None to read all remaining images.
+        """
+        FrameSource.__init__(self, size)
+        self.paths = list_image_files(directory)
+        self.fps = fps
+        self._index = start
+        self.stop = len(self.paths) if stop is None else min(stop, len(self.paths))
+
+    def frame_count(self):
+        return len(self.paths)
+
+    def _read_image(self):
+        if self._index >= self.stop:
+            return None, None
+        image = cv2.imread(self.paths[self._index])
+        if image is None:
+            raise IOError("Failed to read image: " + self.paths[self._index])
+        return image, self._index / self.fps
+
+
+def render_checkerboard_face(index, size):
+    """
+    Draws a two-colored checkerboard cube face drifting across a gray background.
+
+    :param index: The frame index, which determines where the face is.
+    :param size: The (w, h) size of the image to draw.
+
+    >>> image = render_checkerboard_face(0, (106, 80))
+    >>> image.shape
+    (80, 106, 3)
+    >>> image[0, 0].tolist()
+    [128, 128, 128]
+    """
+    w, h = size
+    image = np.zeros((h, w, 3), np.uint8)
+    image[:, :] = (128, 128, 128)
+    r = max(2, min(w, h) // 6)
+    x = r + (index * 2) % max(1, w - 2 * r)
+    y = h // 2
+    dark, light = (10, 30, 200), (130, 90, 70)
+    image[y - r:y, x - r:x] = light
+    image[y:y + r, x:x + r] = light
+    image[y - r:y, x:x + r] = dark
+    image[y:y + r, x - r:x] = dark
+    return image
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Produces generated frames, for exercising the pipeline without a camera or recording.
+    """
+
+    def __init__(self, render=render_checkerboard_face, count=None, size=DEFAULT_FRAME_SIZE, fps=DEFAULT_FRAME_RATE):
+        """
+        :param render: A function taking a frame index and a (w, h) size and returning an image.
+        :param count: How many frames to produce, or None for an endless stream.
+        :param size: The (w, h) size of the generated frames.
+        :param fps: The nominal frame rate, used to produce timestamps.
+
+        >>> frames = list(SyntheticFrameSource(count=2, fps=10))
+        >>> [(f.index, f.timestamp, f.image.shape) for f in frames]
+        [(0, 0.0, (180, 320, 3)), (1, 0.1, (180, 320, 3))]
+        """
+        FrameSource.__init__(self, size)
+        self.render = render
+        self.count = count
+        self.fps = fps
+
+    def _read_image(self):
+        if self.count is not None and self._index >= self.count:
+            return None, None
+        return self.render(self._index, self.size), self._index / self.fps
+
+
+class PrefetchingFrameSource(FrameSource):
+    """
+    Wraps another frame source, reading from it on a background thread so that capturing and decoding the next frame
+    overlaps with processing the current one. Timestamps are those of the wrapped source, i.e. capture times.
+    """
+
+    def __init__(self, source, buffer_size=4, drop_when_full=False):
+        """
+        :param source: The frame source to read from.
+        :param buffer_size: How many frames can be read ahead.
+        :param drop_when_full: When the buffer is full, immediately discard the oldest frame instead of waiting. Live
+        sources should do this with a buffer_size of 1, so that a slow consumer always gets the newest frame instead of
+        falling behind.
+
+        >>> [f.index for f in PrefetchingFrameSource(SyntheticFrameSource(count=5), buffer_size=2)]
+        [0, 1, 2, 3, 4]
+
+        # when dropping, which frames get skipped depends on timing, but they stay in order and the newest isn't lost
+        >>> indices = [f.index for f in PrefetchingFrameSource(SyntheticFrameSource(count=5), 1, drop_when_full=True)]
+        >>> indices == sorted(set(indices)), indices[-1]
+        (True, 4)
+        """
+        FrameSource.__init__(self, source.size)
+        self.source = source
+        self.drop_when_full = drop_when_full
+        self._buffer = Queue.Queue(maxsize=buffer_size)
+        self._stopping = threading.Event()
+        self._done = False
+        self._error = None
+        self._thread = threading.Thread(target=self._prefetch_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        # the end of the source is never dropped, so it waits for room like any frame that isn't dropping others
+        if self.drop_when_full and item is not None:
+            while True:
+                try:
+                    self._buffer.put_nowait(item)
+                    return
+                except Queue.Full:
+                    try:
+                        self._buffer.get_nowait()
+                    except Queue.Empty:
+                        pass
+        while not self._stopping.is_set():
+            try:
+                self._buffer.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def _prefetch_loop(self):
+        try:
+            while not self._stopping.is_set():
+                frame = self.source.read()
+                self._put(frame)
+                if frame is None:
+                    return
+        except Exception as ex:
+            self._error = ex
+            self._put(None)
+
+    def read(self):
+        if self._done:
+            return None
+        frame = self._buffer.get()
+        if frame is None:
+            self._done = True
+            if self._error is not None:
+                raise self._error
+        return frame
+
+    def release(self):
+        self._stopping.set()
+        self._thread.join()
+        self.source.release()
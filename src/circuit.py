@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Circuits of quantum operations, compiled as they are built.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import numpy as np
+import simulator
+import string
+from gates import QuantumOperation
+
+
+def moments(operations):
+    """
+    Layers a sequence of operations into moments: groups of operations touching disjoint wires, which can be applied
+    in any order. Each operation goes into the earliest moment after every earlier operation sharing a wire with it.
+
+    :param operations: A list of QuantumOperation values.
+    :return: A list of moments, each a list of operations in their original order.
+
+    >>> from rotation import Rotation
+    >>> x, z = Rotation(x=0.5).as_pauli_operation(), Rotation(z=0.5).as_pauli_operation()
+    >>> layers = moments([QuantumOperation(x, [None, False, False]), \
+                          QuantumOperation(z, [False, False, None]), \
+                          QuantumOperation(x, [False, None, True]), \
+                          QuantumOperation(z, [None, False, False])])
+    >>> [[(op.gate_char(), op.wire_index) for op in moment] for moment in layers]
+    [[('X', 0), ('Z', 2)], [('X', 1), ('Z', 0)]]
+    """
+    result = []
+    first_free_moment = {}
+    for op in operations:
+        wires = simulator.operation_wires(op)
+        m = max(first_free_moment.get(w, 0) for w in wires)
+        if m == len(result):
+            result.append([])
+        result[m].append(op)
+        for w in wires:
+            first_free_moment[w] = m + 1
+    return result
+
+
+def _drawn_span(op):
+    """
+    Returns the first and last rows of text, between wires, that drawing the operation puts something on.
+    """
+    wires = simulator.operation_wires(op)
+    return min(wires), max(wires) + 1
+
+
+def _merged_column_str(ops, wire_count):
+    """
+    Draws operations with non-overlapping drawn spans in a single column.
+    """
+    lines = [e.__str__().split("\n") for e in ops]
+    blank = ["───" if r % 2 == 1 and r < 2 * wire_count else "   " if r % 2 == 0 else ""
+             for r in range(len(lines[0]))]
+    return "\n".join([([e[r] for e in lines if e[r] != blank[r]] + [blank[r]])[0] for r in range(len(blank))])
+
+
+def moments_str(layers):
+    """
+    Returns a text representation of a layered circuit, drawing each moment in as few columns as possible.
+
+    :param layers: A list of moments, e.g. from the moments function.
+
+    >>> from rotation import Rotation
+    >>> x = Rotation(x=0.5).as_pauli_operation()
+    >>> expected = "┌─┐   \\n" +\
+                   "┤X├─┬─\\n" +\
+                   "└─┘┌┴┐\\n" +\
+                   "───┤X├\\n" +\
+                   "┌─┐└─┘\\n" +\
+                   "┤X├───\\n" +\
+                   "└─┘   \\n"
+    >>> moments_str(moments([QuantumOperation(x, [None, False, False]), \
+                             QuantumOperation(x, [False, False, None]), \
+                             QuantumOperation(x, [True, None, False])])) == expected
+    True
+    """
+    columns = []
+    for moment in layers:
+        # operations whose drawings would overlap go into separate columns
+        placed = []
+        for op in moment:
+            lo, hi = _drawn_span(op)
+            for column in placed:
+                if all(hi < a or b < lo for a, b in map(_drawn_span, column)):
+                    column.append(op)
+                    break
+            else:
+                placed.append([op])
+        columns.extend(_merged_column_str(column, len(moment[0].wire_controls)) for column in placed)
+
+    cols = [string.split(e, "\n") for e in columns]
+    return string.join([string.join([col[r] for col in cols], "") for r in range(len(cols[0]))], "\n")
+
+
+class Circuit(object):
+    """
+    A sequence of quantum operations applied to some wires, starting from the all-off state.
+
+    Appended operations are fused into the last gate when they apply to the same wire with the same controls, and
+    the gate is dropped when that cancels it out, so the cost of simulating the circuit depends on the number of fused
+    gates instead of the number of appended operations. The circuit's unitary and output state are cached, and
+    appending only updates them for the gates that changed.
+
+    >>> from rotation import Rotation
+    >>> def op(rotation, controls):
+    ...     return QuantumOperation(rotation.as_pauli_operation(), controls)
+    >>> c = Circuit(2)
+    >>> c.append(op(Rotation(x=0.25), [None, False]))
+    >>> c.append(op(Rotation(x=0.25), [None, False]))
+    >>> c.append(op(Rotation(y=0.5), [True, None]))
+    >>> [g.gate_char() for g in c.gates]
+    ['X', 'Y']
+    >>> np.allclose(c.state(), [0, 0, 0, 1j])
+    True
+    >>> c.append(op(Rotation(y=-0.5), [True, None]))
+    >>> [g.gate_char() for g in c.gates], np.allclose(c.state(), [0, 1, 0, 0])
+    (['X'], True)
+    >>> c.operation_count, len(c)
+    (4, 1)
+    >>> np.allclose(c.unitary(), op(Rotation(x=0.5), [None, False]).full_operation())
+    True
+    """
+
+    def __init__(self, wire_count):
+        """
+        :param wire_count: The number of wires, i.e. qubits.
+        """
+        self.wire_count = wire_count
+        self.gates = []
+        self.operation_count = 0
+
+        # the unitary and output state of the first _unitary_count and _state_count gates
+        self._unitary = None
+        self._unitary_count = 0
+        self._state = simulator.zero_state(wire_count)
+        self._state_count = 0
+
+    def __len__(self):
+        return len(self.gates)
+
+    def append(self, operation):
+        """
+        Adds an operation to the end of the circuit.
+
+        :param operation: A QuantumOperation with an entry in its wire controls for each of the circuit's wires.
+        """
+        if len(operation.wire_controls) != self.wire_count:
+            raise ValueError("operation doesn't have a wire for each qubit")
+        self.operation_count += 1
+
+        last = self.gates[-1] if len(self.gates) > 0 else None
+        if last is None or last.wire_controls != operation.wire_controls:
+            self.gates.append(operation)
+            return
+
+        self._retract_last_gate()
+        fused = np.mat(operation.single_qubit_operation) * np.mat(last.single_qubit_operation)
+        if np.allclose(fused, np.identity(2)):
+            self.gates.pop()
+        else:
+            self.gates[-1] = QuantumOperation(fused, operation.wire_controls)
+
+    def _retract_last_gate(self):
+        """
+        Undoes the last gate's effect on the cached unitary and state, so it can be changed or removed.
+        """
+        last = self.gates[-1]
+        i = len(self.gates) - 1
+        if self._unitary_count > i:
+            self._unitary = last.full_operation().H * self._unitary
+            self._unitary_count = i
+        if self._state_count > i:
+            inverse = QuantumOperation(np.mat(last.single_qubit_operation).H, last.wire_controls)
+            simulator.apply_operation(self._state, inverse)
+            self._state_count = i
+
+    def unitary(self):
+        """
+        Returns the circuit's full matrix, as a dense numpy matrix. Don't modify it.
+        """
+        if self._unitary is None:
+            self._unitary = np.mat(np.identity(1 << self.wire_count, np.complex128))
+        for gate in self.gates[self._unitary_count:]:
+            self._unitary = gate.full_operation() * self._unitary
+        self._unitary_count = len(self.gates)
+        return self._unitary
+
+    def run(self, states):
+        """
+        Returns the states output by the circuit for the given input states.
+
+        :param states: A state vector, or a (B, 2**n) batch of them, which isn't modified.
+
+        >>> from rotation import Rotation
+        >>> c = Circuit(2)
+        >>> c.append(QuantumOperation(Rotation(x=0.5).as_pauli_operation(), [True, None]))
+        >>> c.run(simulator.basis_states(2, [0, 1, 2, 3])).real.argmax(axis=1).tolist()
+        [0, 3, 2, 1]
+        """
+        result = np.array(states, np.complex128)
+        for moment in moments(self.gates):
+            simulator.apply_moment(result, moment)
+        return result
+
+    def state(self):
+        """
+        Returns the state vector output by the circuit when all of its qubits start off. Don't modify it.
+        """
+        for moment in moments(self.gates[self._state_count:]):
+            simulator.apply_moment(self._state, moment)
+        self._state_count = len(self.gates)
+        return self._state
@@ -10,6 +10,8 @@ import math
 
 import numpy as np
 
+import events
+import orientation
 from rotation import Rotation
 
 
@@ -165,7 +167,24 @@ def classify_color_pair_as_side(color_pair):
     >>> [(e, classify_color_pair_as_side(e)) for e in yellow_orange_samples if classify_color_pair_as_side(e) != Bottom]
     []
     """
-    return min(Sides, key=lambda e: color_pair_distance((e.color1, e.color2), color_pair))
+    return classify_color_pair(color_pair)[0]
+
+
+def classify_color_pair(color_pair):
+    """
+    Matches the given color pair against the expected color pairs, like classify_color_pair_as_side, and also reports
+    how clear-cut the match was.
+    :color_pair: The color pair to classify.
+    :return: (side, margin) where side is the most closely matching Side and margin is how much further away the
+    second closest Side's colors are. Small margins mean the colors could easily have been misread.
+
+    >>> side, margin = classify_color_pair([[130, 90, 70], [10, 30, 200]])
+    >>> side, margin > 0.5
+    (Front, True)
+    """
+    distances = sorted((color_pair_distance((e.color1, e.color2), color_pair), e.index) for e in Sides)
+    (best, index), (runner_up, _) = distances[0], distances[1]
+    return Sides[index], runner_up - best
 
 
 Sides = [Front, Top, Right, Back, Bottom, Left]
@@ -203,6 +222,19 @@ class Facing(object):
             raise ValueError("current_top on same axis as current_front")
         self.current_front = current_front
         self.current_top = current_top
+        self.index = orientation.index_of(current_front.index, current_top.index)
+
+    @staticmethod
+    def from_index(index):
+        """
+        Returns the (shared) Facing instance for an orientation index from the orientation module.
+
+        >>> Facing.from_index(orientation.HOME) == Facing(Front, Top)
+        True
+        >>> Facing.from_index(orientation.X[orientation.HOME]) is Facing(Front, Top).x()
+        True
+        """
+        return Facing.All[index]
 
     def is_top_right_darker(self):
         """
@@ -218,12 +250,16 @@ class Facing(object):
         >>> Facing(Right, Back).is_top_right_darker()
         True
         """
-        return (self.current_front.axis + 1) % 3 == self.current_top.axis
+        return orientation.IS_TOP_RIGHT_DARKER[self.index]
 
     def __eq__(self, other):
-        return isinstance(other, Facing) \
-            and self.current_front == other.current_front \
-            and self.current_top == other.current_top
+        return isinstance(other, Facing) and self.index == other.index
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return self.index
 
     def __repr__(self):
         """
@@ -279,7 +315,7 @@ class Facing(object):
         True
         """
 
-        return Facing(self.current_top, Sides[self.current_front.opposite_index])
+        return Facing.All[orientation.X[self.index]]
 
     def y(self):
         """
@@ -293,7 +329,7 @@ class Facing(object):
         >>> Facing(Left, Front).y() == Facing(Top, Front)
         True
         """
-        return self.x().z().x().x().x()
+        return Facing.All[orientation.Y[self.index]]
 
     def z(self):
         """
@@ -356,17 +392,7 @@ class Facing(object):
         >>> Facing(Left, Back).z() == Facing(Left, Top)
         True
         """
-        new_axis = self.current_top.axis
-        new_sign = self.current_top.sign
-
-        s = 1 if self.current_front.sign == 0 else -1
-        new_axis += s
-        if new_axis % 3 == self.current_front.axis:
-            new_sign += 1
-            new_axis += s
-
-        new_side = (new_axis % 3) + (new_sign % 2) * 3
-        return Facing(self.current_front, Sides[new_side])
+        return Facing.All[orientation.Z[self.index]]
 
     def rotated_by(self, rotation):
         """
@@ -385,32 +411,14 @@ class Facing(object):
         True
         >>> Facing(Front, Top).rotated_by(Rotation(z=-0.25)) == Facing(Front, Left)
         True
+        >>> Facing(Front, Top).rotated_by(Rotation(x=0.5).then(Rotation(y=0.5))) == Facing(Front, Top).z().z()
+        True
+        >>> Facing(Front, Top).rotated_by(Rotation(x=0.1))
+        Traceback (most recent call last):
+            ...
+        ValueError: Can't perform rotations that break axis alignment.
         """
-        if rotation == Rotation():
-            return self
-
-        if rotation == Rotation(x=0.25):
-            return self.x()
-        if rotation == Rotation(x=0.5):
-            return self.x().x()
-        if rotation == Rotation(x=0.75):
-            return self.x().x().x()
-
-        if rotation == Rotation(y=0.25):
-            return self.y()
-        if rotation == Rotation(y=0.5):
-            return self.y().y()
-        if rotation == Rotation(y=0.75):
-            return self.y().y().y()
-
-        if rotation == Rotation(z=0.25):
-            return self.z()
-        if rotation == Rotation(z=0.5):
-            return self.z().z()
-        if rotation == Rotation(z=0.75):
-            return self.z().z().z()
-
-        raise ValueError("Can't perform rotations that break axis alignment.")
+        return Facing.All[orientation.rotated_by(self.index, rotation)]
 
 
 class FrontMeasurement(object):
@@ -443,12 +451,19 @@ class PoseMeasurement(object):
     Cube pose details extracted from a single image or frame.
     """
 
-    def __init__(self, front_measurement, angle, center, corners, color_pair):
+    def __init__(self, front_measurement, angle, center, corners, color_pair, color_margin=None, saddle_score=None):
+        """
+        :param color_margin: How clear-cut the classification of the color pair as a side was, or None if unknown.
+        See classify_color_pair.
+        :param saddle_score: How saddle-like the face's center looked, or None if unknown. See imag.saddle_score.
+        """
         self.front_measurement = front_measurement
         self.angle = angle
         self.corners = corners
         self.center = center
         self.color_pair = color_pair
+        self.color_margin = color_margin
+        self.saddle_score = saddle_score
 
     def __str__(self):
         """
@@ -458,11 +473,141 @@ class PoseMeasurement(object):
         return "%s, turn: %.2f, color: %s, center: (%.0f, %.0f)" \
                % (self.front_measurement,
                   self.angle,
-                  np.array(self.color_pair, np.int32).tolist(),
+                  [[int(c) for c in color] for color in self.color_pair],
                   self.center[0],
                   self.center[1])
 
 
+def _known_or_none(value):
+    return None if np.isnan(value) else float(value)
+
+
+class FramePoseMeasurements(object):
+    """
+    The pose measurements extracted from a single image or frame, stored as parallel numpy arrays instead of as a list
+    of PoseMeasurement instances. Iterating or indexing gives PoseMeasurement views, created on demand.
+    """
+
+    def __init__(self, centers, corners, angles, sides, darker, color_pairs, color_margins=None, saddle_scores=None):
+        """
+        :param centers: An (N, 2) array of face centers.
+        :param corners: An (N, 4, 2) array of face corners.
+        :param angles: An (N,) array of face turns.
+        :param sides: An (N,) array of side indices, into cube.Sides, of the measured front sides.
+        :param darker: An (N,) boolean array of whether the top-right diagonal of each face is darker.
+        :param color_pairs: An (N, 2, 3) array of measured color pairs.
+        :param color_margins: An (N,) array of side classification margins, or None if unknown (stored as NaN).
+        :param saddle_scores: An (N,) array of center saddle scores, or None if unknown (stored as NaN).
+        """
+        self.centers = np.asarray(centers, np.float64).reshape((-1, 2))
+        self.corners = np.asarray(corners, np.float64).reshape((-1, 4, 2))
+        self.angles = np.asarray(angles, np.float64).reshape((-1,))
+        self.sides = np.asarray(sides, np.int8).reshape((-1,))
+        self.darker = np.asarray(darker, np.bool_).reshape((-1,))
+        self.color_pairs = np.asarray(color_pairs, np.float32).reshape((-1, 2, 3))
+        n = len(self.angles)
+        self.color_margins = np.asarray(color_margins if color_margins is not None else [np.nan] * n, np.float32)
+        self.saddle_scores = np.asarray(saddle_scores if saddle_scores is not None else [np.nan] * n, np.float32)
+        self._views = [None] * n
+
+    @staticmethod
+    def from_pose_measurements(pose_measurements):
+        """
+        Packs a list of PoseMeasurement instances. Indexing the result gives back the given instances.
+
+        >>> poses = FramePoseMeasurements.from_pose_measurements([PoseMeasurement( \
+                FrontMeasurement(Top, True), 0.125, (10, 20), [(9, 19), (11, 19), (11, 21), (9, 21)], \
+                [[1, 2, 3], [4, 5, 6]])])
+        >>> len(poses), poses.sides.tolist(), poses.darker.tolist(), poses.centers.tolist()
+        (1, [1], [True], [[10.0, 20.0]])
+        >>> str(poses[0])
+        'front: YellowGreen, is_top_right_darker: True, turn: 0.12, color: [[1, 2, 3], [4, 5, 6]], center: (10, 20)'
+        """
+        result = FramePoseMeasurements(
+            [e.center for e in pose_measurements],
+            [e.corners for e in pose_measurements],
+            [e.angle for e in pose_measurements],
+            [e.front_measurement.current_front.index for e in pose_measurements],
+            [e.front_measurement.is_top_right_darker for e in pose_measurements],
+            [e.color_pair for e in pose_measurements],
+            [np.nan if e.color_margin is None else e.color_margin for e in pose_measurements],
+            [np.nan if e.saddle_score is None else e.saddle_score for e in pose_measurements])
+        result._views = list(pose_measurements)
+        return result
+
+    def __len__(self):
+        return len(self._views)
+
+    def __getitem__(self, i):
+        """
+        Returns a PoseMeasurement view of the i'th measurement. Repeated access returns the same instance.
+        """
+        view = self._views[i]
+        if view is None:
+            view = PoseMeasurement(FrontMeasurement(Sides[self.sides[i]], bool(self.darker[i])),
+                                   float(self.angles[i]),
+                                   self.centers[i],
+                                   [tuple(e) for e in self.corners[i].tolist()],
+                                   self.color_pairs[i],
+                                   _known_or_none(self.color_margins[i]),
+                                   _known_or_none(self.saddle_scores[i]))
+            self._views[i] = view
+        return view
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def areas(self):
+        """
+        Returns an (N,) array of the areas enclosed by each measurement's corners.
+
+        >>> FramePoseMeasurements([(1, 1)], [[(0, 0), (2, 0), (2, 3), (0, 3)]], [0], [0], [False], \
+                                  np.zeros((1, 2, 3))).areas().tolist()
+        [6.0]
+        """
+        x, y = self.corners[:, :, 0], self.corners[:, :, 1]
+        return np.abs(np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1)) / 2
+
+
+# The color classification margin and saddle score at which a measurement's colors and shape are fully trusted.
+FULL_CONFIDENCE_COLOR_MARGIN = 0.5
+FULL_CONFIDENCE_SADDLE_SCORE = 3.0
+
+# How much accumulated confidence, over consecutive agreeing measurements, commits a pose before it has been stable
+# for STABLE_MEASUREMENT_COUNT frames.
+COMMIT_EVIDENCE = 1.0
+STABLE_MEASUREMENT_COUNT = 3
+
+
+def measurement_confidence(pose_measurement, previous_pose_measurement):
+    """
+    Estimates, from 0 to 1, how much a pose measurement can be trusted. Combines how clearly its colors matched a side,
+    how saddle-like its center looked, and how well its angle continues the previous measurement's angle (faces look
+    the same every quarter turn, so the angle is compared modulo a quarter turn). Measurements without color margin or
+    saddle score details get no confidence.
+
+    :param pose_measurement: The measurement to judge.
+    :param previous_pose_measurement: The measurement from the frame before.
+
+    >>> def measured(angle, color_margin=0.5, saddle_score=3.0):
+    ...     return PoseMeasurement(FrontMeasurement(Front, True), angle, (0, 0), [], [], color_margin, saddle_score)
+    >>> measurement_confidence(measured(0.02), measured(0.02))
+    1.0
+    >>> measurement_confidence(measured(0.02, color_margin=0.25), measured(0.02))
+    0.5
+    >>> round(measurement_confidence(measured(0.1), measured(-0.1)), 3)
+    0.6
+    >>> measurement_confidence(measured(0.02, saddle_score=None), measured(0.02))
+    0.0
+    """
+    measurements = FramePoseMeasurements.from_pose_measurements([pose_measurement])
+    return float(measurement_confidences(measurements.color_margins,
+                                         measurements.saddle_scores,
+                                         measurements.angles,
+                                         np.array([previous_pose_measurement.angle]))[0])
+
+
 class PoseTrack(object):
     """
     Accumulated cube pose details from measurements over time.
@@ -473,12 +618,59 @@ class PoseTrack(object):
                  stable_pose_measurement,
                  last_pose_measurement,
                  last_pose_measurement_stability,
-                 rotations):
+                 rotations,
+                 operation=None,
+                 last_pose_measurement_evidence=0.0,
+                 speculation=None):
+        """
+        :param rotations: The list of rotations tracked so far.
+        :param operation: The aggregate quantum operation of the given rotations, if already known.
+        :param last_pose_measurement_evidence: The confidence accumulated over the run of measurements agreeing with the
+        last one.
+        :param speculation: None, or a (previous facing, previous front measurement, rotations) tuple when the stable
+        pose was committed on confidence alone and hasn't been confirmed by enough agreeing measurements yet. The
+        previous facing and front measurement are the stable ones from before the commit, and the rotations are the ones
+        the commit added.
+        """
         self.facing = facing
         self.stable_pose_measurement = stable_pose_measurement
         self.last_pose_measurement = last_pose_measurement
         self.last_pose_measurement_stability = last_pose_measurement_stability
-        self.rotations = rotations
+        self.last_pose_measurement_evidence = last_pose_measurement_evidence
+        self.speculation = speculation
+        self._rotations = rotations
+        self._operation = operation
+
+    @property
+    def rotations(self):
+        return self._rotations
+
+    @rotations.setter
+    def rotations(self, rotations):
+        self._rotations = rotations
+        self._operation = None
+
+    @staticmethod
+    def _updated_operation(operation, old_rotations, new_rotations):
+        """
+        Adjusts the aggregate operation of a list of rotations to match a list that shares a prefix with it, undoing the
+        rotations that were removed from the end and then applying the ones that were added.
+
+        >>> old = [Rotation(x=0.25), Rotation(y=0.25)]
+        >>> new = Rotation.plus_rotation_simplified(old[:1], Rotation(z=0.25))
+        >>> op = PoseTrack._updated_operation(PoseTrack(None, None, None, None, old).quantum_operation(), old, new)
+        >>> np.allclose(op, PoseTrack(None, None, None, None, new).quantum_operation())
+        True
+        """
+        # simplification only touches the end of the list, so the shared prefix is found by walking backwards
+        n = min(len(old_rotations), len(new_rotations))
+        while n > 0 and old_rotations[n - 1] is not new_rotations[n - 1]:
+            n -= 1
+        for r in reversed(old_rotations[n:]):
+            operation = r.as_pauli_operation().H * operation
+        for r in new_rotations[n:]:
+            operation = r.as_pauli_operation() * operation
+        return operation
 
     def quantum_operation(self):
         """
@@ -499,49 +691,376 @@ class PoseTrack(object):
                  [0, -1j]])).all()
         True
         """
-        operations = [r.as_pauli_operation() for r in self.rotations]
-        return reduce(lambda e1, e2: e2 * e1, operations, Rotation().as_pauli_operation())
+        if self._operation is None:
+            operations = [r.as_pauli_operation() for r in self.rotations]
+            self._operation = reduce(lambda e1, e2: e2 * e1, operations, Rotation().as_pauli_operation())
+        return self._operation
 
     def then(self, new_pose_measurement):
         """
-        Uses the given measurement to continue tracking the cube, and returns an updated PoseTrack instance.
+        Uses the given measurement to continue tracking the cube, and returns an updated PoseTrack instance. Runs
+        PoseTrackBank.then on a single-track bank, so it follows the rules documented there.
         :param new_pose_measurement The latest measurement of where the cube is and how it is oriented.
+
+        >>> measurement = PoseMeasurement(FrontMeasurement(Top, False), 0.0, (0, 0), [], [])
+        >>> track = PoseTrack.Empty.then(measurement)
+        >>> track.last_pose_measurement is measurement, track.last_pose_measurement_stability, track.facing
+        (True, 0, Current front=BlueRed, top=YellowGreen)
         """
-        new_pose_measurement_stability = self.last_pose_measurement_stability + 1 \
-            if new_pose_measurement.front_measurement == self.last_pose_measurement.front_measurement \
-            else 0
-
-        new_facing = self.facing
-        new_stable_measurement = self.stable_pose_measurement
-        new_rotations = self.rotations
-
-        if new_pose_measurement_stability >= 3:
-            new_stable_measurement = new_pose_measurement
-
-            # if the front side changed, use the new side to figure out which quarter X or Y rotation happened
-            # TODO: what about quick 180s?
-            if new_facing.current_front != new_pose_measurement.front_measurement.current_front:
-                adj = [(new_facing.rotated_by(r), r)
-                       for r in [Rotation(x=0.25), Rotation(x=-0.25), Rotation(y=0.25), Rotation(y=-0.25)]]
-                for facing, rotation in adj:
-                    if facing.current_front == new_pose_measurement.front_measurement.current_front:
-                        new_facing = facing
-                        new_rotations = Rotation.plus_rotation_simplified(new_rotations, rotation)
-
-            # if diagonals are flipped, guess which Z rotation happened based on the last stable measured angle
-            if new_facing.is_top_right_darker() != new_pose_measurement.front_measurement.is_top_right_darker:
-                advance = self.stable_pose_measurement.angle < 0
-                r = Rotation(z=0.25 if advance else -0.25)
+        bank = PoseTrackBank.from_tracks([self])
+        bank.then([0], FramePoseMeasurements.from_pose_measurements([new_pose_measurement]), [0])
+        return bank.view(0).snapshot()
+
+
+def measurement_confidences(color_margins, saddle_scores, angles, previous_angles):
+    """
+    Vectorized measurement_confidence, over arrays of measurement details.
+
+    :param color_margins: The measurements' color classification margins (NaN if unknown).
+    :param saddle_scores: The measurements' saddle scores (NaN if unknown).
+    :param angles: The measurements' angles.
+    :param previous_angles: The angles of the measurements from the frame before.
+
+    >>> measurement_confidences(np.array([0.5, 0.25, np.nan]), np.array([3.0, 3.0, 3.0]), np.array([0.02] * 3), \
+                                np.array([0.02] * 3)).tolist()
+    [1.0, 0.5, 0.0]
+    """
+    color = np.clip(np.nan_to_num(color_margins) / FULL_CONFIDENCE_COLOR_MARGIN, 0, 1)
+    shape = np.clip(np.nan_to_num(saddle_scores) / FULL_CONFIDENCE_SADDLE_SCORE, 0, 1)
+    angle_change = np.abs((angles - previous_angles + 0.125) % 0.25 - 0.125)
+    continuity = 1 - np.minimum(1.0, angle_change / 0.125)
+    return np.where(np.isnan(color_margins) | np.isnan(saddle_scores), 0.0, color * shape * continuity)
+
+
+class PoseTrackBank(object):
+    """
+    The state of many pose tracks, stored as parallel arrays and advanced together, one batched step per frame.
+    PoseTrack.then advances a single-track bank, so both follow the same rules. PoseTrackView gives a PoseTrack-like
+    view of a single track.
+    """
+
+    def __init__(self, count):
+        """
+        :param count: The number of tracks. They all start out like PoseTrack.Empty.
+        """
+        self.count = count
+        self.orientations = np.zeros(count, np.int16) + orientation.HOME
+        self.controls = np.zeros(count, np.bool_)
+
+        # the stable and last measurements, as (container, index) sources with their front measurement and angle
+        self.stable_sources = np.array([None] * count, object)
+        self.stable_indices = np.zeros(count, np.int32)
+        self.stable_sides = np.zeros(count, np.int8) + PoseMeasurement.Empty.front_measurement.current_front.index
+        self.stable_darker = np.zeros(count, np.bool_) + PoseMeasurement.Empty.front_measurement.is_top_right_darker
+        self.stable_angles = np.zeros(count, np.float64) + PoseMeasurement.Empty.angle
+        self.last_sources = np.array([None] * count, object)
+        self.last_indices = np.zeros(count, np.int32)
+        self.last_sides = np.copy(self.stable_sides)
+        self.last_darker = np.copy(self.stable_darker)
+        self.last_angles = np.copy(self.stable_angles)
+        self.stabilities = np.zeros(count, np.int32)
+        self.evidences = np.zeros(count, np.float64)
+
+        # unconfirmed commits: the stable orientation and front measurement from before, and the added rotations with
+        # the controls they were published with
+        self.speculating = np.zeros(count, np.bool_)
+        self.speculation_orientations = np.zeros(count, np.int16)
+        self.speculation_sides = np.zeros(count, np.int8)
+        self.speculation_darker = np.zeros(count, np.bool_)
+        self.speculation_rotations = [[] for _ in range(count)]
+        self.speculation_controls = [None] * count
+
+        # the rotations of each track, and their aggregate operations (valid where operation_known is set)
+        self.rotations = [[] for _ in range(count)]
+        self.operations = np.zeros((count, 2, 2), np.complex128) + np.eye(2)
+        self.operation_known = np.ones(count, np.bool_)
+        self.operation_versions = np.zeros(count, np.int64)
+
+        # every rotation added to a track is also published here, as an events.RotationEvent
+        self.events = events.EventStream()
+
+    @staticmethod
+    def from_tracks(tracks):
+        """
+        Returns a bank whose tracks start out in the same state as the given PoseTrack instances.
+
+        >>> track = PoseTrack.Empty.then(PoseMeasurement(FrontMeasurement(Top, False), 0.0, (0, 0), [], [], 0.5, 3.0))
+        >>> view = PoseTrackBank.from_tracks([PoseTrack.Empty, track]).view(1)
+        >>> view.facing, view.rotations, view.speculation is not None
+        (Current front=YellowGreen, top=PurpleOrange, [X:¼], True)
+        """
+        bank = PoseTrackBank(len(tracks))
+        for i, track in enumerate(tracks):
+            bank.orientations[i] = track.facing.index
+            for sources, indices, sides, darker, angles, measurement in [
+                    (bank.stable_sources, bank.stable_indices, bank.stable_sides, bank.stable_darker,
+                     bank.stable_angles, track.stable_pose_measurement),
+                    (bank.last_sources, bank.last_indices, bank.last_sides, bank.last_darker,
+                     bank.last_angles, track.last_pose_measurement)]:
+                sources[i] = [measurement]
+                indices[i] = 0
+                sides[i] = measurement.front_measurement.current_front.index
+                darker[i] = measurement.front_measurement.is_top_right_darker
+                angles[i] = measurement.angle
+            bank.stabilities[i] = track.last_pose_measurement_stability
+            bank.evidences[i] = track.last_pose_measurement_evidence
+            if track.speculation is not None:
+                previous_facing, previous_front_measurement, speculative_rotations = track.speculation
+                bank.speculating[i] = True
+                bank.speculation_orientations[i] = previous_facing.index
+                bank.speculation_sides[i] = previous_front_measurement.current_front.index
+                bank.speculation_darker[i] = previous_front_measurement.is_top_right_darker
+                bank.speculation_rotations[i] = speculative_rotations
+            bank.rotations[i] = track.rotations
+            bank.operation_known[i] = track._operation is not None
+            if track._operation is not None:
+                bank.operations[i] = track._operation
+        return bank
+
+    def then(self, track_indices, pose_measurements, measurement_indices, controlled=None, timestamp=None):
+        """
+        Continues tracking the given tracks, each with a measurement from the latest frame.
+
+        :param track_indices: The tracks that were measured.
+        :param pose_measurements: The frame's cube.FramePoseMeasurements.
+        :param measurement_indices: For each given track, the index of its measurement.
+        :param controlled: For each given track, whether its measurement puts it in the controlling state, which it
+        enters if the measurement is committed. None leaves the control flags alone.
+        :param timestamp: When the frame was captured, for the published rotation events.
+        :return: A boolean array of which of the given tracks committed their measurement as the stable one.
+
+        >>> def measured(side, is_top_right_darker, angle=0.0):
+        ...     return FramePoseMeasurements.from_pose_measurements([PoseMeasurement( \
+                        FrontMeasurement(side, is_top_right_darker), angle, (0, 0), [(0, 0)] * 4, [[0] * 3] * 2)])
+        >>> bank = PoseTrackBank(2)
+        >>> subscription = bank.events.subscribe()
+        >>> for side in [Top] * 4 + [Bottom] * 4:
+        ...     committed = bank.then([1], measured(side, False), [0])
+        >>> bank.view(1).facing, bank.view(1).rotations, committed.tolist()
+        (Current front=OrangeYellow, top=BlueRed, [X:¾], [True])
+        >>> np.allclose(bank.view(1).quantum_operation(), Rotation(x=0.75).as_pauli_operation())
+        True
+        >>> bank.view(0).facing, bank.view(0).rotations
+        (Current front=BlueRed, top=YellowGreen, [])
+        >>> subscription.drain()
+        [track 1: X:¼, controls [False, None], at None, track 1: X:¼, controls [False, None], at None, \
+track 1: X:¼, controls [False, None], at None]
+
+        # confident measurements are committed right away, and taken back if the measurements revert, undoing the
+        # rotations with the controls they were done with
+        >>> def confidently_measured(side, darker):
+        ...     return FramePoseMeasurements.from_pose_measurements([PoseMeasurement( \
+                        FrontMeasurement(side, darker), 0.0, (0, 0), [(0, 0)] * 4, [[0] * 3] * 2, 0.5, 3.0)])
+        >>> bank = PoseTrackBank(2)
+        >>> subscription = bank.events.subscribe()
+        >>> committed = bank.then([1], confidently_measured(Top, False), [0], controlled=[False])
+        >>> bank.view(1).facing, bank.view(1).rotations, bank.view(1).speculation is not None
+        (Current front=YellowGreen, top=PurpleOrange, [X:¼], True)
+        >>> committed = bank.then([0], confidently_measured(Front, True), [0], controlled=[True])
+        >>> committed = bank.then([1], confidently_measured(Front, False), [0], controlled=[False])
+        >>> bank.view(1).facing, bank.view(1).rotations, bank.view(1).speculation
+        (Current front=BlueRed, top=YellowGreen, [], None)
+        >>> subscription.drain()
+        [track 1: X:¼, controls [False, None], at None, track 1: X:¾, controls [False, None], at None]
+        """
+        t = np.asarray(track_indices, np.int64)
+        m = np.asarray(measurement_indices, np.int64)
+        if len(t) == 0:
+            return np.zeros(0, np.bool_)
+        sides = pose_measurements.sides[m]
+        darker = pose_measurements.darker[m]
+        angles = pose_measurements.angles[m]
+
+        is_same_as_last = (sides == self.last_sides[t]) & (darker == self.last_darker[t])
+        stabilities = np.where(is_same_as_last, self.stabilities[t] + 1, 0)
+        evidences = np.where(is_same_as_last, self.evidences[t], 0.0) + measurement_confidences(
+            pose_measurements.color_margins[m], pose_measurements.saddle_scores[m], angles, self.last_angles[t])
+
+        is_stable = stabilities >= STABLE_MEASUREMENT_COUNT
+        commit = is_stable | (evidences >= COMMIT_EVIDENCE)
+        retract = commit & self.speculating[t] \
+            & (sides == self.speculation_sides[t]) & (darker == self.speculation_darker[t])
+        resolve = commit & ~retract
+        old_orientations = self.orientations[t]
+        new_orientations = orientation.RESOLVED[old_orientations,
+                                                sides,
+                                                darker.astype(np.int64),
+                                                (self.stable_angles[t] < 0).astype(np.int64)]
+        moved = resolve & (new_orientations != old_orientations)
+        speculate = moved & ~is_stable
+
+        if controlled is not None:
+            self.controls[t[commit]] = np.asarray(controlled, np.bool_)[commit]
+
+        # rotations only change when a cube actually turns, so these are handled one track at a time
+        for k in np.flatnonzero(retract | moved):
+            i = t[k]
+            old_rotations = self.rotations[i]
+            controls = [None if j == i else bool(self.controls[j]) for j in range(self.count)]
+            if retract[k]:
+                added_rotations = [-r for r in reversed(self.speculation_rotations[i])]
+                if self.speculation_controls[i] is not None:
+                    controls = self.speculation_controls[i]
+                self.speculation_rotations[i] = []
+                self.speculation_controls[i] = None
+            else:
+                added_rotations = [orientation.QUARTER_TURNS[turn][0]
+                                   for turn in orientation.SHORTEST_PATHS[old_orientations[k]][new_orientations[k]]]
+                self.speculation_rotations[i] = added_rotations if speculate[k] else []
+                self.speculation_controls[i] = controls if speculate[k] else None
+            new_rotations = old_rotations
+            for r in added_rotations:
                 new_rotations = Rotation.plus_rotation_simplified(new_rotations, r)
-                new_facing = new_facing.z()
-                if not advance:
-                    new_facing = new_facing.z().z()
+                self.events.publish(events.RotationEvent(i, r, controls, timestamp))
+            self.rotations[i] = new_rotations
+            if self.operation_known[i]:
+                self.operations[i] = PoseTrack._updated_operation(np.mat(self.operations[i]),
+                                                                  old_rotations,
+                                                                  new_rotations)
+            self.operation_versions[i] += 1
+
+        tr, tm, ts = t[retract], t[moved], t[speculate]
+        self.orientations[tr] = self.speculation_orientations[tr]
+        self.orientations[tm] = new_orientations[moved]
+        self.speculation_orientations[ts] = old_orientations[speculate]
+        self.speculation_sides[ts] = self.stable_sides[ts]
+        self.speculation_darker[ts] = self.stable_darker[ts]
+        self.speculating[t[retract | (resolve & is_stable)]] = False
+        self.speculating[ts] = True
+
+        # (wrapped, so numpy doesn't try to treat the container as a sequence of values)
+        source = np.empty((), object)
+        source[()] = pose_measurements
+
+        tc = t[commit]
+        self.stable_sources[tc] = source
+        self.stable_indices[tc] = m[commit]
+        self.stable_sides[tc] = sides[commit]
+        self.stable_darker[tc] = darker[commit]
+        self.stable_angles[tc] = angles[commit]
+
+        self.last_sources[t] = source
+        self.last_indices[t] = m
+        self.last_sides[t] = sides
+        self.last_darker[t] = darker
+        self.last_angles[t] = angles
+        self.stabilities[t] = stabilities
+        self.evidences[t] = evidences
+        return commit
+
+    def set_rotations(self, i, rotations):
+        """
+        Replaces a track's list of rotations, e.g. with an empty list once they have been consumed.
+        """
+        self.rotations[i] = rotations
+        self.operation_known[i] = False
+        self.operation_versions[i] += 1
 
-        return PoseTrack(new_facing,
-                         new_stable_measurement,
-                         new_pose_measurement,
-                         new_pose_measurement_stability,
-                         new_rotations)
+    def quantum_operation(self, i):
+        """
+        Returns the aggregate quantum operation of a track's rotations, as a new matrix that later updates to the bank
+        don't change.
+
+        >>> bank = PoseTrackBank(1)
+        >>> before = bank.quantum_operation(0)
+        >>> bank.set_rotations(0, [Rotation(x=0.5)])
+        >>> np.allclose(before, np.identity(2)), np.allclose(bank.quantum_operation(0), [[0, 1], [1, 0]])
+        (True, True)
+        """
+        if not self.operation_known[i]:
+            operations = [r.as_pauli_operation() for r in self.rotations[i]]
+            self.operations[i] = reduce(lambda e1, e2: e2 * e1, operations, Rotation().as_pauli_operation())
+            self.operation_known[i] = True
+        return np.matrix(self.operations[i], copy=True)
+
+    def pose_measurement(self, sources, indices, i):
+        source = sources[i]
+        return PoseMeasurement.Empty if source is None else source[indices[i]]
+
+    def view(self, i):
+        """
+        Returns a PoseTrack-like view of a track.
+        """
+        return PoseTrackView(self, i)
+
+
+class PoseTrackView(object):
+    """
+    A view of one of the tracks in a PoseTrackBank, with the same attributes as a PoseTrack.
+    """
+
+    def __init__(self, bank, index):
+        self.bank = bank
+        self.index = index
+
+    @property
+    def facing(self):
+        return Facing.from_index(self.bank.orientations[self.index])
+
+    @property
+    def stable_pose_measurement(self):
+        return self.bank.pose_measurement(self.bank.stable_sources, self.bank.stable_indices, self.index)
+
+    @property
+    def last_pose_measurement(self):
+        return self.bank.pose_measurement(self.bank.last_sources, self.bank.last_indices, self.index)
+
+    @property
+    def last_pose_measurement_stability(self):
+        return int(self.bank.stabilities[self.index])
+
+    @property
+    def last_pose_measurement_evidence(self):
+        return float(self.bank.evidences[self.index])
+
+    @property
+    def speculation(self):
+        i = self.index
+        if not self.bank.speculating[i]:
+            return None
+        return (Facing.from_index(self.bank.speculation_orientations[i]),
+                FrontMeasurement(Sides[self.bank.speculation_sides[i]], bool(self.bank.speculation_darker[i])),
+                self.bank.speculation_rotations[i])
+
+    @property
+    def rotations(self):
+        return self.bank.rotations[self.index]
+
+    @rotations.setter
+    def rotations(self, rotations):
+        self.bank.set_rotations(self.index, rotations)
+
+    @property
+    def operation_version(self):
+        """
+        A number that changes whenever the track's quantum operation might have changed.
+        """
+        return self.bank.operation_versions[self.index]
+
+    def quantum_operation(self):
+        return self.bank.quantum_operation(self.index)
+
+    def snapshot(self):
+        """
+        Returns an independent PoseTrack with this track's current state.
+        """
+        return PoseTrack(self.facing,
+                         self.stable_pose_measurement,
+                         self.last_pose_measurement,
+                         self.last_pose_measurement_stability,
+                         list(self.rotations),
+                         self.quantum_operation() if self.bank.operation_known[self.index] else None,
+                         self.last_pose_measurement_evidence,
+                         self.speculation)
+
+    def then(self, new_pose_measurement):
+        """
+        Returns the independent PoseTrack that PoseTrack.then would give for this track's current state.
+        """
+        return self.snapshot().then(new_pose_measurement)
+
+
+Facing.All = [Facing(Sides[front], Sides[top]) for front, top in orientation.ORIENTATIONS]
 
 PoseMeasurement.Empty = PoseMeasurement(FrontMeasurement(Front, False),
                                         0,
@@ -549,7 +1068,14 @@ PoseMeasurement.Empty = PoseMeasurement(FrontMeasurement(Front, False),
                                         [(0, 0), (0, 0), (0, 0), (0, 0)],
                                         [[0, 0, 0], [0, 0, 0]])
 
-PoseTrack.Empty = PoseTrack(Facing(Front, Top),
+FramePoseMeasurements.Empty = FramePoseMeasurements(np.zeros((0, 2)),
+                                                    np.zeros((0, 4, 2)),
+                                                    np.zeros(0),
+                                                    np.zeros(0),
+                                                    np.zeros(0),
+                                                    np.zeros((0, 2, 3)))
+
+PoseTrack.Empty = PoseTrack(Facing.from_index(orientation.HOME),
                             PoseMeasurement.Empty,
                             PoseMeasurement.Empty,
                             0,
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Streams of events published by the tracker, e.g. rotations being committed, for consumers to react to as they happen.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import collections
+
+
+class RotationEvent(object):
+    """
+    A tracked cube was rotated.
+    """
+
+    def __init__(self, track_index, rotation, controls, timestamp):
+        """
+        :param track_index: The index of the track (i.e. qubit) whose cube was rotated.
+        :param rotation: The Rotation that was applied.
+        :param controls: For each track, whether it was controlling the rotation when it happened, and None for the
+        rotated track itself. Suitable as the wire controls of a gates.QuantumOperation.
+        :param timestamp: When the frame that caused the rotation was captured, or None if not known.
+        """
+        self.track_index = track_index
+        self.rotation = rotation
+        self.controls = controls
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        """
+        >>> from rotation import Rotation
+        >>> RotationEvent(1, Rotation(x=0.25), [False, None, True], 2.5)
+        track 1: X:¼, controls [False, None, True], at 2.5
+        """
+        return "track %d: %r, controls %r, at %r" % (self.track_index, self.rotation, self.controls, self.timestamp)
+
+
+class Subscription(object):
+    """
+    A bounded queue of the events published to a stream since subscribing. When full, the oldest events are dropped.
+    """
+
+    def __init__(self, max_events):
+        """
+        :param max_events: How many undrained events to keep.
+        """
+        self._events = collections.deque(maxlen=max_events)
+        self.dropped = 0
+
+    def push(self, event):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(event)
+
+    def drain(self):
+        """
+        Removes and returns the pending events, oldest first.
+        """
+        result = list(self._events)
+        self._events.clear()
+        return result
+
+    def __len__(self):
+        return len(self._events)
+
+
+class EventStream(object):
+    """
+    Delivers published events to every subscription.
+
+    >>> stream = EventStream()
+    >>> first, second = stream.subscribe(), stream.subscribe(max_events=2)
+    >>> for e in ['a', 'b', 'c']:
+    ...     stream.publish(e)
+    >>> first.drain(), second.drain(), second.dropped, first.drain()
+    (['a', 'b', 'c'], ['b', 'c'], 1, [])
+    >>> stream.unsubscribe(first)
+    >>> stream.publish('d')
+    >>> len(first), len(second)
+    (0, 1)
+    """
+
+    def __init__(self):
+        self._subscriptions = []
+
+    def subscribe(self, max_events=1024):
+        """
+        Returns a new Subscription receiving the events published from now on.
+
+        :param max_events: How many undrained events the subscription keeps.
+        """
+        subscription = Subscription(max_events)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.remove(subscription)
+
+    def publish(self, event):
+        for subscription in self._subscriptions:
+            subscription.push(event)
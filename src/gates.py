@@ -7,10 +7,17 @@ Geometric utility methods used by cube finding program.
 
 from __future__ import division  # so 1/2 returns 0.5 instead of 0
 import geom
+import numpy as np
+import sparse_matrix
 import string
 from rotation import *
 
 
+# Projectors onto a qubit being off and on.
+_OFF_PROJECTOR = np.array([[1, 0], [0, 0]])
+_ON_PROJECTOR = np.array([[0, 0], [0, 1]])
+
+
 class QuantumOperation(object):
     """
     A quantum operation that can be applied to one of several qubits, and controlled by other qubits.
@@ -26,20 +33,32 @@ class QuantumOperation(object):
         self.single_qubit_operation = single_qubit_operation
         self.wire_index = wire_controls.index(None)
         self.wire_controls = wire_controls
+        self._interpolation = None
 
-    def interpolated_operation(self, t):
+    def interpolated(self, t):
         """
         Returns a gradually-applied version of this operation, where t=0 is not applied at all and t=1 is fully applied.
         :param t: The interpolation factor.
         """
-        op = unitary_lerp(Rotation().as_pauli_operation(), self.single_qubit_operation, t)
-        return QuantumOperation(op, self.wire_controls).full_operation()
+        if self._interpolation is None:
+            self._interpolation = UnitaryInterpolation(Rotation().as_pauli_operation(), self.single_qubit_operation)
+        return QuantumOperation(self._interpolation.at(t), self.wire_controls)
+
+    def interpolated_operation(self, t):
+        """
+        Returns the full matrix of a gradually-applied version of this operation. See interpolated.
+        :param t: The interpolation factor.
+        """
+        return self.interpolated(t).full_operation()
 
-    def full_operation(self):
+    def full_operation(self, sparse=False):
         """
         Returns this quantum operation's full matrix that, when multiplied by the full state vector for the circuit,
         applies the gate to the state.
 
+        :param sparse: Whether to return a sparse matrix (see sparse_matrix.from_entries) instead of a dense numpy
+        matrix. The sparse matrix has at most two non-zero entries per row, so it stays small for many wires.
+
         >>> (QuantumOperation(np.mat([[2, 3], [4, 5]]), [True, None, False]).full_operation() ==\
             np.mat([[1, 0, 0, 0, 0, 0, 0, 0],\
                     [0, 2, 0, 3, 0, 0, 0, 0],\
@@ -60,7 +79,16 @@ class QuantumOperation(object):
                     [0, 0, 0, 0, 4, 0, 5, 0],\
                     [0, 0, 0, 0, 0, 4, 0, 5]])).all()
         True
+        >>> op = QuantumOperation(Rotation(y=0.25).as_pauli_operation(), [False, True, False, None, True])
+        >>> (op.full_operation(sparse=True).todense() == op.full_operation()).all()
+        True
         """
+        if sparse:
+            return self._sparse_full_operation()
+
+        kron = self.kron_operation()
+        if kron is not None:
+            return kron.materialize()
 
         acc = self.single_qubit_operation
         id2 = np.identity(2)
@@ -77,6 +105,58 @@ class QuantumOperation(object):
 
         return acc
 
+    def kron_operation(self):
+        """
+        Returns this quantum operation's full matrix as a geom.KronOperator, i.e. kept as the gate tensored with
+        identities for the other wires, or None when the operation has controls and so isn't such a tensor product.
+
+        >>> (QuantumOperation(np.mat([[0, 1], [1, 0]]), [False, None, False]).kron_operation() * np.arange(8)).tolist()
+        [2, 3, 0, 1, 6, 7, 4, 5]
+        >>> QuantumOperation(np.mat([[0, 1], [1, 0]]), [True, None, False]).kron_operation() is None
+        True
+        """
+        if any(self.wire_controls):
+            return None
+        # the first factor is the most significant one, i.e. the last wire
+        return geom.KronOperator([self.single_qubit_operation if c is None else None
+                                  for c in reversed(self.wire_controls)],
+                                 [2] * len(self.wire_controls))
+
+    def _sparse_full_operation(self):
+        n = 1 << len(self.wire_controls)
+        bit = 1 << self.wire_index
+        control_mask = sum(1 << i for i, is_control in enumerate(self.wire_controls) if is_control)
+        states = np.arange(n)
+        is_active = states & control_mask == control_mask
+
+        # inactive states are left alone, active ones mix with the state that has the target bit flipped
+        idle, active = states[~is_active], states[is_active]
+        m = np.asarray(self.single_qubit_operation)
+        row_bit = (active & bit) // bit
+        rows = np.concatenate([idle, active, active])
+        cols = np.concatenate([idle, active & ~bit, active | bit])
+        values = np.concatenate([np.ones(len(idle), m.dtype), m[row_bit, 0], m[row_bit, 1]])
+        return sparse_matrix.from_entries(rows, cols, values, (n, n))
+
+    @staticmethod
+    def circuit_operation(ops, sparse=False):
+        """
+        Returns the full matrix applying a sequence of operations, first to last.
+
+        :param ops: A non-empty list of QuantumOperation values, all with the same number of wires.
+        :param sparse: Whether to multiply and return sparse matrices, instead of dense numpy matrices.
+
+        >>> ops = [QuantumOperation(Rotation(x=0.25).as_pauli_operation(), [None, True, False]), \
+                   QuantumOperation(Rotation(z=0.5).as_pauli_operation(), [False, None, True]), \
+                   QuantumOperation(Rotation(y=0.75).as_pauli_operation(), [True, False, None])]
+        >>> dense = QuantumOperation.circuit_operation(ops)
+        >>> (dense == ops[2].full_operation() * ops[1].full_operation() * ops[0].full_operation()).all()
+        True
+        >>> np.allclose(QuantumOperation.circuit_operation(ops, sparse=True).todense(), dense)
+        True
+        """
+        return reduce(lambda acc, op: op.full_operation(sparse) * acc, ops[1:], ops[0].full_operation(sparse))
+
     @staticmethod
     def quantum_complex_str(c):
         """
@@ -185,12 +265,9 @@ class QuantumOperation(object):
                  [0, 0, 0, 0, 41, 43, 47, 51]])).all()
         True
         """
-        d = m.shape[0]
-        return np.mat([[m[i - d, j - d] if i >= d and j >= d
-                        else 1 if i == j
-                        else 0
-                        for j in range(2*d)]
-                       for i in range(2*d)])
+        # |0⟩⟨0| ⊗ I + |1⟩⟨1| ⊗ m, with the new qubit as the most significant bit
+        m = np.asarray(m)
+        return np.mat(np.kron(_OFF_PROJECTOR, np.eye(m.shape[0], dtype=m.dtype)) + np.kron(_ON_PROJECTOR, m))
 
     @staticmethod
     def controlled_by_prev_qbit(m):
@@ -219,12 +296,9 @@ class QuantumOperation(object):
                  [0,41, 0,43, 0,47, 0,51]])).all()
         True
         """
-        d = m.shape[0]
-        return np.mat([[m[i // 2, j // 2] if i % 2 == 1 and j % 2 == 1
-                        else 1 if i == j
-                        else 0
-                        for j in range(2*d)]
-                       for i in range(2*d)])
+        # I ⊗ |0⟩⟨0| + m ⊗ |1⟩⟨1|, with the new qubit as the least significant bit
+        m = np.asarray(m)
+        return np.mat(np.kron(np.eye(m.shape[0], dtype=m.dtype), _OFF_PROJECTOR) + np.kron(m, _ON_PROJECTOR))
 
     def gate_char(self):
         """
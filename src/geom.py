@@ -51,6 +51,91 @@ def tensor_power(m, p):
     return reduce(tensor_product, [m for _ in range(p)], np.mat([[1]]))
 
 
+class KronOperator(object):
+    """
+    A tensor product of square matrices A1⊗A2⊗...⊗An, kept as its factors instead of being multiplied out. Applying
+    it to a vector contracts one factor at a time, and identity factors (e.g. for wires a gate doesn't touch) are
+    skipped entirely.
+
+    Like np.kron, the first factor corresponds to the most significant part of an index.
+
+    >>> a, b = np.mat([[0, 1], [1, 0]]), np.mat([[1, 2], [3, 4]])
+    >>> op = KronOperator([a, None, b], [2, 3, 2])
+    >>> (op.materialize() == tensor_product(tensor_product(a, np.identity(3)), b)).all()
+    True
+    >>> v = np.arange(12)
+    >>> (op * v == op.materialize().dot(v).A1).all()
+    True
+    >>> ((2 * op * op).materialize() == 2 * op.materialize() ** 2).all()
+    True
+    """
+
+    def __init__(self, factors, dims=None, scale=1):
+        """
+        :param factors: The square matrices being tensored together, first to last. None stands for an identity.
+        :param dims: The size of each factor. Only needed when there are identity factors.
+        :param scale: A scalar the whole product is multiplied by.
+        """
+        self.factors = [None if f is None else np.asarray(f) for f in factors]
+        if dims is None:
+            dims = [f.shape[0] for f in self.factors]
+        self.dims = list(dims)
+        self.scale = scale
+
+    @staticmethod
+    def identity(dims):
+        """
+        Returns the identity operator over factors of the given sizes, e.g. [2] * n for n qubits.
+        """
+        return KronOperator([None] * len(dims), dims)
+
+    @property
+    def shape(self):
+        n = int(np.prod(self.dims))
+        return n, n
+
+    def tensor(self, other):
+        """
+        Returns the tensor product of this operator (first) and another KronOperator.
+        """
+        return KronOperator(self.factors + other.factors, self.dims + other.dims, self.scale * other.scale)
+
+    def apply(self, v):
+        """
+        Returns the result of multiplying this operator by a vector, or by the columns of a matrix.
+
+        :param v: An array with shape (n,) or (n, k), where n is the size of the operator.
+        """
+        v = np.asarray(v)
+        t = v.reshape(self.dims + list(v.shape[1:]))
+        for axis, f in enumerate(self.factors):
+            if f is not None:
+                t = np.moveaxis(np.tensordot(f, t, axes=([1], [axis])), 0, axis)
+        return self.scale * t.reshape(v.shape)
+
+    def __mul__(self, other):
+        if isinstance(other, KronOperator):
+            if self.dims != other.dims:
+                raise ValueError("factor sizes don't match")
+            factors = [b if a is None else a if b is None else a.dot(b) for a, b in zip(self.factors, other.factors)]
+            return KronOperator(factors, self.dims, self.scale * other.scale)
+        if np.isscalar(other):
+            return KronOperator(self.factors, self.dims, self.scale * other)
+        return self.apply(other)
+
+    def __rmul__(self, other):
+        if np.isscalar(other):
+            return KronOperator(self.factors, self.dims, self.scale * other)
+        return NotImplemented
+
+    def materialize(self):
+        """
+        Returns the operator as a dense numpy matrix.
+        """
+        factors = [np.identity(d) if f is None else f for f, d in zip(self.factors, self.dims)]
+        return np.mat(reduce(np.kron, factors, np.identity(1)) * self.scale)
+
+
 def sign(n):
     """
     Determines if a number is negative, zero, or positive.
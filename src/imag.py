@@ -54,6 +54,30 @@ CIRCLE_SAMPLE_DELTAS_3x3 = [(-1, 0),
                             (0, +1)]
 
 
+def wrapped_shifter(image, max_shift):
+    """
+    Returns a function that gives the same result as rolling an image by a (row, col) offset, but as a view into a
+    wrapped-around padding of the image instead of as a copy.
+
+    :param image: An rgb or gray-scale image, as a numpy array.
+    :param max_shift: The largest offset magnitude that will be requested, along either axis.
+
+    >>> image = np.arange(12).reshape(3, 4)
+    >>> shift = wrapped_shifter(image, 2)
+    >>> (shift((1, -2)) == np.roll(np.roll(image, 1, 0), -2, 1)).all()
+    True
+    """
+    p = int(max_shift)
+    h, w = image.shape[:2]
+    padding = [(p, p), (p, p)] + [(0, 0)] * (image.ndim - 2)
+    padded = np.pad(image, padding, 'wrap') if p > 0 else image
+
+    def shift(d):
+        r, c = p - int(d[0]), p - int(d[1])
+        return padded[r:r + h, c:c + w]
+    return shift
+
+
 def valley_transform(image, circle_deltas=None, sample_radius_factor=2):
     """
     Edge detection transform, favoring long straight boundaries between homogeneous areas.
@@ -110,11 +134,11 @@ def valley_transform(image, circle_deltas=None, sample_radius_factor=2):
     h = n // 2
 
     float_image = np.array(image, np.float32)
-    rolls = [np.roll(np.roll(float_image, c[0], 0), c[1], 1) for c in circle_deltas]
+    shift = wrapped_shifter(float_image, max(abs(e) for c in circle_deltas for e in c))
 
     t = float_image * 0
     for i in range(h):
-        t += np.abs(rolls[i] - rolls[i - h])
+        t += np.abs(shift(circle_deltas[i]) - shift(circle_deltas[i - h]))
 
     float_scores = t / h
     scores = np.array(np.clip(float_scores, 0, 255), np.uint8)
@@ -171,26 +195,15 @@ def saddle_transform(image, circle_deltas=None, sample_radius_factor=2):
                            for i in range(n)]
 
     float_image = np.array(image, np.int16)
-
-    rolls_x = {dx: np.roll(float_image, dx, 0)
-               for dx in set([d[0] for d in quarter_turn_deltas])}
-    rolls_xy = {d: np.roll(rolls_x[d[0]], d[1], 1)
-                for d in quarter_turn_deltas
-                if d[0] >= 0 or d[1] > 0}
-    difs_xy = {d: float_image - rolls_xy[d]
-               for d in quarter_turn_deltas
-               if d[0] >= 0 or d[1] > 0}
-    difs_xy = {d: difs_xy[d]
-               if d[0] >= 0 or d[1] > 0
-               else np.roll(np.roll(-difs_xy[vector_scale(d, -1)], d[0], 0), d[1], 1)
-               for d in quarter_turn_deltas}
+    shift = wrapped_shifter(float_image, max(abs(e) for c in circle_deltas + quarter_turn_deltas for e in c))
 
     # At a saddle point, points 90 degrees off should disagree by roughly +-d for some d
     # Since half the time it's +d and half the time it's -d, there should be a large standard deviation
+    # (Each term is the difference between the image and its quarter-turn-delta shift, shifted back by the circle delta)
     float_scores = float_image * 0
     for i in range(n):
-        float_scores += np.abs(
-            np.roll(np.roll(difs_xy[quarter_turn_deltas[i]], -circle_deltas[i][1], 1), -circle_deltas[i][0], 0))
+        c = vector_scale(circle_deltas[i], -1)
+        float_scores += np.abs(shift(c) - shift(vector_sum(c, quarter_turn_deltas[i])))
     scores = np.array(np.clip(float_scores / n, 0, 255), np.uint8)
 
     return scores
@@ -606,13 +619,30 @@ def distance_from_cross_points_to_frame(cross_end_points, frame_corners):
                 for e in cross_end_points])
 
 
-def find_checkerboard_cube_faces(input_frame, draw_frame):
+def is_in_any_window(point, windows):
+    """
+    Determines if a point is within (or on the edge of) any of the given areas.
+
+    :param point: The (x, y) point.
+    :param windows: A list of (x, y, w, h) areas.
+
+    >>> is_in_any_window((5, 5), [(0, 0, 2, 2), (4, 4, 1, 1)]), is_in_any_window((5, 5), [(0, 0, 2, 2)])
+    (True, False)
+    """
+    px, py = point
+    return any(x <= px <= x + w and y <= py <= y + h for x, y, w, h in windows)
+
+
+def find_checkerboard_cube_faces(input_frame, draw_frame, candidate_windows=None):
     """
     Tries to find faces of checkerboard cubes.
 
     :param input_frame: A raw rgb image of reasonable size.
     :param draw_frame: A copy of the input image to draw debug information on.
-    :return: A list of cube.PoseMeasurement instances; one for each found face.
+    :param candidate_windows: A list of (x, y, w, h) areas that face centers are expected to be within, or None to
+    accept centers anywhere. Candidate centers outside of every window are skipped before the per-candidate checks.
+    The whole frame is still transformed, so this only saves the work done for rejected candidates.
+    :return: A cube.FramePoseMeasurements with one measurement for each found face.
     """
     valley_trans = valley_transform(input_frame)
     valley_trans_fine = valley_transform(input_frame, circle_deltas=CIRCLE_SAMPLE_DELTAS_5x5, sample_radius_factor=1)
@@ -623,7 +653,16 @@ def find_checkerboard_cube_faces(input_frame, draw_frame):
     # find centers
     gray_saddle_trans = rgb_max_to_gray(combined)
     local_maximas = find_isolated_local_maxima(gray_saddle_trans)
-    candidates = []
+    if candidate_windows is not None:
+        local_maximas = [e for e in local_maximas if is_in_any_window(e, candidate_windows)]
+    centers = []
+    corners = []
+    angles = []
+    sides = []
+    darker = []
+    color_pairs = []
+    color_margins = []
+    saddle_scores = []
     for center in local_maximas:
         if gray_saddle_trans[center[1]][center[0]] < 30:
             continue
@@ -652,21 +691,29 @@ def find_checkerboard_cube_faces(input_frame, draw_frame):
             continue
 
         color_pair = measure_checkerboard_color_inside(input_frame, diag_corners)
-        side = cube.classify_color_pair_as_side(color_pair)
+        side, color_margin = cube.classify_color_pair(color_pair)
         is_top_right_darker = np.max(color_pair[0]) > np.max(color_pair[1])
 
         mid = np.average(diag_corners, axis=0)
         right_topward_corner = winded(diag_corners)[0]
         turns = vector_angle(vector_dif(right_topward_corner, mid))/math.pi/2 - 0.125
-        pose = cube.PoseMeasurement(cube.FrontMeasurement(side, is_top_right_darker),
-                                    turns,
-                                    mid,
-                                    diag_corners,
-                                    color_pair)
-
-        candidates.append(pose)
-
-    return candidates
+        centers.append(mid)
+        corners.append(diag_corners)
+        angles.append(turns)
+        sides.append(side.index)
+        darker.append(is_top_right_darker)
+        color_pairs.append(color_pair)
+        color_margins.append(color_margin)
+        saddle_scores.append(s)
+
+    return cube.FramePoseMeasurements(centers,
+                                      corners,
+                                      angles,
+                                      sides,
+                                      darker,
+                                      color_pairs,
+                                      color_margins,
+                                      saddle_scores)
 
 
 def distance_from_point_to_cycle_path(point, path_points):
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Motion models for predicting where tracked cube faces will be in upcoming frames.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import math
+import numpy as np
+
+
+def wrap_quarter_turn(turns):
+    """
+    Wraps an angle difference into [-1/8, 1/8) turns. Checkerboard faces look the same after every quarter turn, so
+    measured face angles can only be compared modulo a quarter turn.
+
+    :param turns: The angle difference, in turns.
+
+    >>> wrap_quarter_turn(0.05)
+    0.05
+    >>> wrap_quarter_turn(0.2)
+    -0.05
+    >>> wrap_quarter_turn(-0.2)
+    0.05
+    """
+    return round((turns + 0.125) % 0.25 - 0.125, 12)
+
+
+class MotionModel(object):
+    """
+    A constant velocity Kalman filter over a face's center and in-plane angle.
+
+    The state is [x, y, angle, x velocity, y velocity, angle velocity], with positions in pixels, angles in turns and
+    velocities per frame.
+    """
+
+    # How much the velocities are expected to wander each frame (standard deviations).
+    POSITION_ACCELERATION = 2.0
+    ANGLE_ACCELERATION = 0.01
+
+    # How noisy measurements are expected to be (standard deviations).
+    POSITION_NOISE = 2.0
+    ANGLE_NOISE = 0.02
+
+    # How many frames in a row can go by without a measurement before the model is considered lost.
+    MAX_MISSES = 5
+
+    def __init__(self, center, angle):
+        """
+        :param center: The (x, y) center of the first measurement.
+        :param angle: The angle, in turns, of the first measurement.
+        """
+        self.state = np.mat([[center[0]], [center[1]], [angle], [0.0], [0.0], [0.0]])
+        self.covariance = np.mat(np.diag([MotionModel.POSITION_NOISE ** 2,
+                                          MotionModel.POSITION_NOISE ** 2,
+                                          MotionModel.ANGLE_NOISE ** 2,
+                                          10.0 ** 2,
+                                          10.0 ** 2,
+                                          0.05 ** 2]))
+        self.misses = 0
+
+        self._transition = np.mat(np.eye(6))
+        self._transition[0:3, 3:6] = np.eye(3)
+        accelerations = [MotionModel.POSITION_ACCELERATION,
+                         MotionModel.POSITION_ACCELERATION,
+                         MotionModel.ANGLE_ACCELERATION]
+        g = np.mat(np.vstack([np.diag([0.5] * 3), np.eye(3)]))
+        self._process_noise = g * np.mat(np.diag(np.square(accelerations))) * g.T
+        self._observation = np.mat(np.hstack([np.eye(3), np.zeros((3, 3))]))
+        self._measurement_noise = np.mat(np.diag([MotionModel.POSITION_NOISE ** 2,
+                                                  MotionModel.POSITION_NOISE ** 2,
+                                                  MotionModel.ANGLE_NOISE ** 2]))
+
+    def predict(self):
+        """
+        Advances the model by one frame.
+
+        >>> m = MotionModel((10, 20), 0)
+        >>> m.update((12, 20), 0)
+        >>> m.predict()
+        >>> m.update((14, 20), 0)
+        >>> m.predict()
+        >>> x, y = m.center()
+        >>> 15 < x < 17, round(y, 6)
+        (True, 20.0)
+        """
+        self.state = self._transition * self.state
+        self.covariance = self._transition * self.covariance * self._transition.T + self._process_noise
+
+    def update(self, center, angle):
+        """
+        Corrects the model using a measurement of the face in the current frame.
+
+        :param center: The measured (x, y) center.
+        :param angle: The measured angle, in turns.
+        """
+        innovation = np.mat([[center[0] - self.state[0, 0]],
+                             [center[1] - self.state[1, 0]],
+                             [wrap_quarter_turn(angle - self.state[2, 0])]])
+        s = self._observation * self.covariance * self._observation.T + self._measurement_noise
+        gain = self.covariance * self._observation.T * s.I
+        self.state = self.state + gain * innovation
+        self.covariance = (np.mat(np.eye(6)) - gain * self._observation) * self.covariance
+        self.misses = 0
+
+    def miss(self):
+        """
+        Notes that the face wasn't measured in the current frame, so the model is coasting on its prediction.
+        """
+        self.misses += 1
+
+    def is_lost(self):
+        """
+        Determines if too many frames went by without a measurement for the prediction to be trusted.
+
+        >>> m = MotionModel((0, 0), 0)
+        >>> for _ in range(MotionModel.MAX_MISSES):
+        ...     m.miss()
+        >>> m.is_lost()
+        False
+        >>> m.miss()
+        >>> m.is_lost()
+        True
+        """
+        return self.misses > MotionModel.MAX_MISSES
+
+    def center(self):
+        """
+        Returns the predicted (x, y) center.
+        """
+        return self.state[0, 0], self.state[1, 0]
+
+    def angle(self):
+        """
+        Returns the predicted angle, in turns.
+        """
+        return self.state[2, 0]
+
+    def gating_radius(self, sigmas=3.0, min_radius=5.0):
+        """
+        Returns how far from the predicted center a measurement can be while still plausibly being the tracked face.
+
+        :param sigmas: How many standard deviations of position uncertainty to allow.
+        :param min_radius: The smallest radius to return, no matter how certain the prediction is.
+
+        >>> m = MotionModel((0, 0), 0)
+        >>> r1 = m.gating_radius()
+        >>> m.predict()
+        >>> m.gating_radius() > r1
+        True
+        """
+        position_covariance = self._observation[0:2] * self.covariance * self._observation[0:2].T \
+            + self._measurement_noise[0:2, 0:2]
+        largest_variance = max(np.linalg.eigvalsh(position_covariance))
+        return max(min_radius, sigmas * math.sqrt(largest_variance))
+
+    def gate(self, center, sigmas=3.0):
+        """
+        Determines if a measured center is close enough to the prediction to be associated with it.
+
+        :param center: The measured (x, y) center.
+        :param sigmas: How many standard deviations of position uncertainty to allow.
+
+        >>> MotionModel((0, 0), 0).gate((3, 4)), MotionModel((0, 0), 0).gate((30, 40))
+        (True, False)
+        """
+        x, y = self.center()
+        return math.hypot(center[0] - x, center[1] - y) <= self.gating_radius(sigmas)
+
+    def search_window(self, face_radius, sigmas=3.0):
+        """
+        Returns an (x, y, w, h) area that the tracked face's center should be within in the current frame.
+
+        :param face_radius: Extra space to leave around the predicted center, e.g. for the size of the face.
+        :param sigmas: How many standard deviations of position uncertainty to allow.
+
+        >>> x, y, w, h = MotionModel((50, 60), 0).search_window(10)
+        >>> x + w / 2, y + h / 2
+        (50.0, 60.0)
+        """
+        x, y = self.center()
+        r = self.gating_radius(sigmas) + face_radius
+        return x - r, y - r, 2 * r, 2 * r
@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+The 24 axis-aligned orientations of a cube, as small integers, with precomputed tables for rotating and composing them.
+
+An orientation is identified by which cube side (a cube.Side index) is at the front and which is at the top. Each
+orientation doubles as the rotation that takes the home orientation (Front side at the front, Top side at the top) to
+it, so orientations can be composed, inverted and translated to and from Rotation instances.
+
+Rotations are around world axes, following the conventions of cube.Facing: a quarter X turn moves the top side to the
+front, a quarter Y turn moves the left side to the front and a quarter Z turn moves the right side to the top.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import numpy as np
+from rotation import Rotation, quaternion_key, reach_all
+
+
+def _is_valid(front, top):
+    return front % 3 != top % 3
+
+# All (front side index, top side index) pairs, in index order.
+ORIENTATIONS = tuple((front, top) for front in range(6) for top in range(6) if _is_valid(front, top))
+COUNT = len(ORIENTATIONS)
+
+_INDEX_OF = {e: i for i, e in enumerate(ORIENTATIONS)}
+
+
+def index_of(front, top):
+    """
+    Returns the orientation with the given sides at the front and top.
+
+    :param front: The side index of the side at the front.
+    :param top: The side index of the side at the top.
+
+    >>> index_of(0, 1) == HOME
+    True
+    >>> ORIENTATIONS[index_of(3, 2)]
+    (3, 2)
+    >>> index_of(0, 3)
+    Traceback (most recent call last):
+        ...
+    ValueError: top on same axis as front
+    """
+    i = _INDEX_OF.get((front, top))
+    if i is None:
+        raise ValueError("top on same axis as front")
+    return i
+
+
+def _x(front, top):
+    return top, (front + 3) % 6
+
+
+def _z(front, top):
+    axis = top % 3
+    sign = top // 3
+    s = 1 if front < 3 else -1
+    axis += s
+    if axis % 3 == front % 3:
+        sign += 1
+        axis += s
+    return front, (axis % 3) + (sign % 2) * 3
+
+
+HOME = index_of(0, 1)
+FRONT = tuple(front for front, _ in ORIENTATIONS)
+TOP = tuple(top for _, top in ORIENTATIONS)
+
+# Whether the front side shows its darker color along the bottom-left-to-top-right diagonal.
+IS_TOP_RIGHT_DARKER = tuple((front % 3 + 1) % 3 == top % 3 for front, top in ORIENTATIONS)
+
+# The orientation after a counter-clockwise quarter turn around each world axis.
+X = tuple(index_of(*_x(*e)) for e in ORIENTATIONS)
+Z = tuple(index_of(*_z(*e)) for e in ORIENTATIONS)
+Y = tuple(X[X[X[Z[X[i]]]]] for i in range(COUNT))
+
+# Quarter turns, paired with the orientation tables that apply them.
+GENERATORS = ((Rotation(x=0.25), X), (Rotation(y=0.25), Y), (Rotation(z=0.25), Z))
+
+# For each orientation, a sequence of GENERATORS indices that turns the home orientation into it.
+_WORDS = tuple(word for _, word in sorted(reach_all(HOME, GENERATORS, lambda i, generator: generator[1][i])))
+
+
+def _apply_word(i, word):
+    for g in word:
+        i = GENERATORS[g][1][i]
+    return i
+
+# THEN[a][b] is the orientation reached by applying rotation a and then rotation b, i.e. b applied to orientation a.
+THEN = tuple(tuple(_apply_word(a, _WORDS[b]) for b in range(COUNT)) for a in range(COUNT))
+
+INVERSE = tuple(THEN[a].index(HOME) for a in range(COUNT))
+
+
+def _rotation_of_word(word):
+    r = Rotation()
+    for g in word:
+        r = r.then(GENERATORS[g][0])
+    return r
+
+ROTATION = tuple(_rotation_of_word(w) for w in _WORDS)
+
+_FROM_ROTATION_KEY = {quaternion_key(r.as_quaternion()): i for i, r in enumerate(ROTATION)}
+
+
+def from_rotation(rotation):
+    """
+    Returns the orientation that the given rotation turns the home orientation into.
+
+    :param rotation: The Rotation. Must be an axis-aligned rotation.
+
+    >>> from_rotation(Rotation()) == HOME
+    True
+    >>> ORIENTATIONS[from_rotation(Rotation(x=0.25))]
+    (1, 3)
+    >>> from_rotation(Rotation(y=-0.75)) == from_rotation(Rotation(y=0.25)) == Y[HOME]
+    True
+    >>> from_rotation(Rotation(x=0.5).then(Rotation(y=0.5))) == from_rotation(Rotation(z=0.5))
+    True
+    >>> from_rotation(Rotation(x=0.1))
+    Traceback (most recent call last):
+        ...
+    ValueError: Can't perform rotations that break axis alignment.
+    """
+    i = _FROM_ROTATION_KEY.get(quaternion_key(rotation.as_quaternion()))
+    if i is None:
+        raise ValueError("Can't perform rotations that break axis alignment.")
+    return i
+
+
+def rotated_by(i, rotation):
+    """
+    Returns the orientation reached by rotating an orientation by the given axis-aligned rotation.
+
+    :param i: The orientation to rotate.
+    :param rotation: The Rotation to rotate by.
+
+    >>> rotated_by(HOME, Rotation(y=0.25)) == Y[HOME]
+    True
+    >>> all(THEN[a][b] == rotated_by(a, ROTATION[b]) for a in range(COUNT) for b in range(COUNT))
+    True
+    >>> all(THEN[a][INVERSE[a]] == THEN[INVERSE[a]][a] == HOME for a in range(COUNT))
+    True
+    >>> all(_FROM_ROTATION_KEY[quaternion_key(ROTATION[b].as_quaternion() * ROTATION[a].as_quaternion())] \
+            == THEN[a][b] for a in range(COUNT) for b in range(COUNT))
+    True
+    """
+    return THEN[i][from_rotation(rotation)]
+
+
+def _inverse_table(table):
+    result = [None] * COUNT
+    for i, j in enumerate(table):
+        result[j] = i
+    return tuple(result)
+
+# Every quarter turn, paired with the orientation table that applies it.
+QUARTER_TURNS = ((Rotation(x=0.25), X),
+                 (Rotation(x=-0.25), _inverse_table(X)),
+                 (Rotation(y=0.25), Y),
+                 (Rotation(y=-0.25), _inverse_table(Y)),
+                 (Rotation(z=0.25), Z),
+                 (Rotation(z=-0.25), _inverse_table(Z)))
+
+
+def _shortest_paths_from(start):
+    """
+    Breadth-first searches outward from an orientation, finding a fewest-quarter-turns path to every orientation.
+    Paths are tuples of QUARTER_TURNS indices. Ties go to the path found first, i.e. the one with earlier turns.
+    """
+    paths = {start: ()}
+    frontier = [start]
+    while len(frontier) > 0:
+        next_frontier = []
+        for i in frontier:
+            for t, (_, table) in enumerate(QUARTER_TURNS):
+                j = table[i]
+                if j not in paths:
+                    paths[j] = paths[i] + (t,)
+                    next_frontier.append(j)
+        frontier = next_frontier
+    return tuple(paths[i] for i in range(COUNT))
+
+# SHORTEST_PATHS[a][b] is a tuple of QUARTER_TURNS indices that turns orientation a into orientation b.
+SHORTEST_PATHS = tuple(_shortest_paths_from(a) for a in range(COUNT))
+
+
+def _z_bias(path, advance_z):
+    turn = 4 if advance_z else 5
+    return sum(1 if t == turn else -1 if t in [4, 5] else 0 for t in path)
+
+
+def _resolve(i, front, is_top_right_darker, advance_z):
+    candidates = [j for j in range(COUNT) if FRONT[j] == front and IS_TOP_RIGHT_DARKER[j] == is_top_right_darker]
+    return min(candidates, key=lambda j: (len(SHORTEST_PATHS[i][j]), -_z_bias(SHORTEST_PATHS[i][j], advance_z), j))
+
+_RESOLVED = {(i, front, is_top_right_darker, advance_z): _resolve(i, front, is_top_right_darker, advance_z)
+             for i in range(COUNT)
+             for front in range(6)
+             for is_top_right_darker in [False, True]
+             for advance_z in [False, True]}
+
+# The orientations picked by resolve_measurement, as an array indexed by
+# [orientation, front side index, is_top_right_darker, advance_z] for looking up many at once.
+def _resolved_array():
+    result = np.zeros((COUNT, 6, 2, 2), np.int16)
+    for (i, front, is_top_right_darker, advance_z), j in _RESOLVED.items():
+        result[i, front, int(is_top_right_darker), int(advance_z)] = j
+    result.flags.writeable = False
+    return result
+
+RESOLVED = _resolved_array()
+
+
+def resolve_measurement(i, front, is_top_right_darker, advance_z):
+    """
+    Determines which orientation a cube most likely turned into, given its previous orientation and what is now
+    visible: the front side and which of its diagonals is darker. Several orientations look the same from the front, so
+    the one reachable with the fewest quarter turns is picked. When that still leaves a choice, the one that turned
+    around the Z axis in the expected direction wins.
+
+    :param i: The previous orientation.
+    :param front: The side index of the side now at the front.
+    :param is_top_right_darker: Whether the front's darker diagonal goes from bottom-left to top-right.
+    :param advance_z: Whether a counter-clockwise (as opposed to clockwise) Z turn is expected, e.g. because the last
+    stable measured angle of the front side was leaning that way.
+    :return: (orientation, path) where path is a tuple of QUARTER_TURNS indices leading from i to orientation.
+
+    >>> resolve_measurement(HOME, 0, True, True) == (HOME, ())
+    True
+    >>> [QUARTER_TURNS[t][0] for t in resolve_measurement(HOME, 0, False, True)[1]]
+    [Z:¼]
+    >>> [QUARTER_TURNS[t][0] for t in resolve_measurement(HOME, 0, False, False)[1]]
+    [Z:¾]
+    >>> [QUARTER_TURNS[t][0] for t in resolve_measurement(HOME, 5, False, False)[1]]
+    [Y:¼]
+    >>> [QUARTER_TURNS[t][0] for t in resolve_measurement(HOME, 3, True, False)[1]]
+    [Y:¼, Y:¼]
+    >>> [QUARTER_TURNS[t][0] for t in resolve_measurement(HOME, 1, True, True)[1]]
+    [X:¼, Z:¼]
+    >>> [QUARTER_TURNS[t][0] for t in resolve_measurement(HOME, 1, True, False)[1]]
+    [X:¼, Z:¾]
+    >>> RESOLVED[HOME, 1, 1, 0] == resolve_measurement(HOME, 1, True, False)[0]
+    True
+    """
+    j = _RESOLVED[(i, front, is_top_right_darker, advance_z)]
+    return j, SHORTEST_PATHS[i][j]
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+A compact binary recording format for sessions of the cube finding program: the processed frames, when they were
+captured, and the pose measurements found in each of them.
+
+A recording is a directory containing:
+- header.json: the frame width, height and channel count.
+- frames.bin: the frames' raw pixels, back to back, every frame taking the same number of bytes.
+- index.bin: an INDEX_DTYPE record per frame, with its timestamp and which pose records belong to it.
+- poses.bin: POSE_DTYPE records for every pose measurement, in frame order.
+
+Fixed-size frames and index records mean any frame, and its measurements, can be located without scanning.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import json
+import os
+import numpy as np
+import capture
+import cube
+
+
+POSE_DTYPE = np.dtype([('frame', np.int32),
+                       ('timestamp', np.float64),
+                       ('center', np.float32, (2,)),
+                       ('angle', np.float32),
+                       ('corners', np.float32, (4, 2)),
+                       ('color_pair', np.float32, (2, 3)),
+                       ('side', np.int8),
+                       ('is_top_right_darker', np.bool_),
+                       ('color_margin', np.float32),
+                       ('saddle_score', np.float32)])
+
+INDEX_DTYPE = np.dtype([('timestamp', np.float64),
+                        ('pose_start', np.int64),
+                        ('pose_count', np.int32)])
+
+HEADER_FILE = 'header.json'
+FRAMES_FILE = 'frames.bin'
+INDEX_FILE = 'index.bin'
+POSES_FILE = 'poses.bin'
+
+
+def pose_records(frame_index, timestamp, pose_measurements):
+    """
+    Packs a frame's pose measurements into a structured array.
+
+    :param frame_index: The index of the frame the measurements came from.
+    :param timestamp: When the frame was captured.
+    :param pose_measurements: A cube.FramePoseMeasurements.
+
+    >>> records = pose_records(7, 0.25, cube.FramePoseMeasurements.from_pose_measurements([cube.PoseMeasurement( \
+            cube.FrontMeasurement(cube.Top, True), 0.125, (10, 20), [(9, 19), (11, 19), (11, 21), (9, 21)], \
+            [[1, 2, 3], [4, 5, 6]])]))
+    >>> records['frame'].tolist(), records['side'].tolist(), records['center'].tolist()
+    ([7], [1], [[10.0, 20.0]])
+    """
+    records = np.zeros(len(pose_measurements), POSE_DTYPE)
+    records['frame'] = frame_index
+    records['timestamp'] = timestamp
+    records['center'] = pose_measurements.centers
+    records['angle'] = pose_measurements.angles
+    records['corners'] = pose_measurements.corners
+    records['color_pair'] = pose_measurements.color_pairs
+    records['side'] = pose_measurements.sides
+    records['is_top_right_darker'] = pose_measurements.darker
+    records['color_margin'] = pose_measurements.color_margins
+    records['saddle_score'] = pose_measurements.saddle_scores
+    return records
+
+
+def pose_measurements_from_records(records):
+    """
+    Unpacks POSE_DTYPE records into a cube.FramePoseMeasurements.
+
+    :param records: The records to unpack.
+
+    >>> poses = cube.FramePoseMeasurements.from_pose_measurements([cube.PoseMeasurement( \
+            cube.FrontMeasurement(cube.Back, False), 0.125, (10, 20), [(9, 19), (11, 19), (11, 21), (9, 21)], \
+            [[1, 2, 3], [4, 5, 6]])])
+    >>> str(pose_measurements_from_records(pose_records(0, 0, poses))[0]) == str(poses[0])
+    True
+    """
+    return cube.FramePoseMeasurements(records['center'],
+                                      records['corners'],
+                                      records['angle'],
+                                      records['side'],
+                                      records['is_top_right_darker'],
+                                      records['color_pair'],
+                                      records['color_margin'],
+                                      records['saddle_score'])
+
+
+class RecordingWriter(object):
+    """
+    Appends frames and their pose measurements to a recording.
+    """
+
+    def __init__(self, directory, size, channels=3):
+        """
+        :param directory: The directory to write the recording into. Created if it doesn't exist.
+        :param size: The (w, h) size of the recorded frames.
+        :param channels: The number of color channels in the recorded frames.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.size = tuple(size)
+        self.channels = channels
+        self.frame_count = 0
+        self.pose_count = 0
+        with open(os.path.join(directory, HEADER_FILE), 'w') as f:
+            json.dump({'width': size[0], 'height': size[1], 'channels': channels}, f)
+        self._frames = open(os.path.join(directory, FRAMES_FILE), 'wb')
+        self._index = open(os.path.join(directory, INDEX_FILE), 'wb')
+        self._poses = open(os.path.join(directory, POSES_FILE), 'wb')
+
+    def append(self, image, timestamp, pose_measurements):
+        """
+        Records a frame and the pose measurements found in it.
+
+        :param image: The processed frame, which must have the recording's size.
+        :param timestamp: When the frame was captured.
+        :param pose_measurements: A cube.FramePoseMeasurements of the measurements found in the frame.
+        """
+        w, h = self.size
+        if image.shape != (h, w, self.channels) or image.dtype != np.uint8:
+            raise ValueError("frame doesn't match the recording's frame size")
+        records = pose_records(self.frame_count, timestamp, pose_measurements)
+
+        # frame and poses are handed to the OS before the index record is, so if this process dies the index doesn't
+        # refer to data that was still sitting in its buffers (RecordingReader also clips anything left dangling)
+        self._frames.write(np.ascontiguousarray(image).tostring())
+        self._poses.write(records.tostring())
+        self._frames.flush()
+        self._poses.flush()
+        self._index.write(np.array([(timestamp, self.pose_count, len(records))], INDEX_DTYPE).tostring())
+
+        self.frame_count += 1
+        self.pose_count += len(records)
+
+    def close(self):
+        for f in [self._frames, self._poses, self._index]:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _memmap_records(path, dtype):
+    count = os.path.getsize(path) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+class RecordingReader(object):
+    """
+    Memory-maps a recording, giving constant time access to any frame and its pose measurements.
+
+    >>> import tempfile, shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> pose = cube.PoseMeasurement(cube.FrontMeasurement(cube.Right, True), -0.1, (2, 3), \
+                                    [(1, 2), (3, 2), (3, 4), (1, 4)], [[1, 2, 3], [4, 5, 6]])
+    >>> with RecordingWriter(directory, (4, 3)) as writer:
+    ...     writer.append(np.zeros((3, 4, 3), np.uint8), 0.5, cube.FramePoseMeasurements.Empty)
+    ...     writer.append(np.ones((3, 4, 3), np.uint8), 0.75, \
+                          cube.FramePoseMeasurements.from_pose_measurements([pose, pose]))
+    >>> reader = RecordingReader(directory)
+    >>> len(reader), reader.timestamps.tolist()
+    (2, [0.5, 0.75])
+    >>> reader.frame(1).tolist() == np.ones((3, 4, 3)).tolist()
+    True
+    >>> len(reader.pose_records(0)), [str(e) == str(pose) for e in reader.pose_measurements(1)]
+    (0, [True, True])
+    >>> reader.close()
+
+    # frames whose pose records didn't all get written are dropped
+    >>> with open(os.path.join(directory, POSES_FILE), 'r+b') as f:
+    ...     f.truncate(POSE_DTYPE.itemsize)
+    >>> len(RecordingReader(directory))
+    1
+    >>> shutil.rmtree(directory)
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory containing the recording.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, HEADER_FILE)) as f:
+            header = json.load(f)
+        self.size = (header['width'], header['height'])
+        self.channels = header['channels']
+        shape = (header['height'], header['width'], header['channels'])
+        stride = int(np.prod(shape))
+
+        self.index = _memmap_records(os.path.join(directory, INDEX_FILE), INDEX_DTYPE)
+        self.poses = _memmap_records(os.path.join(directory, POSES_FILE), POSE_DTYPE)
+
+        # a recording cut short (e.g. by a crash) may have a partially written last frame, or last pose records
+        frames_path = os.path.join(directory, FRAMES_FILE)
+        n = min(len(self.index), os.path.getsize(frames_path) // stride)
+        pose_ends = self.index['pose_start'][:n] + self.index['pose_count'][:n]
+        n = int(np.searchsorted(pose_ends, len(self.poses), side='right'))
+        self.index = self.index[:n]
+        self.frames = np.memmap(frames_path, dtype=np.uint8, mode='r', shape=(n,) + shape) if n > 0 \
+            else np.zeros((0,) + shape, np.uint8)
+        self.timestamps = self.index['timestamp']
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, i):
+        """
+        Returns the i'th recorded frame, as a read-only view into the recording.
+        """
+        return self.frames[i]
+
+    def pose_records(self, i):
+        """
+        Returns the POSE_DTYPE records of the pose measurements found in the i'th frame.
+        """
+        start = int(self.index[i]['pose_start'])
+        return self.poses[start:start + int(self.index[i]['pose_count'])]
+
+    def pose_measurements(self, i):
+        """
+        Returns the pose measurements found in the i'th frame, as a cube.FramePoseMeasurements.
+        """
+        return pose_measurements_from_records(self.pose_records(i))
+
+    def close(self):
+        self.frames = None
+        self.index = None
+        self.poses = None
+        self.timestamps = None
+
+
+class RecordingFrameSource(capture.FrameSource):
+    """
+    Replays the frames of a recording, with their original timestamps.
+    """
+
+    def __init__(self, directory, size=None, start=0, stop=None):
+        """
+        :param directory: The directory containing the recording.
+        :param size: The (w, h) size frames should have, or None to keep the recorded size.
+        :param start: The index of the first frame to replay.
+        :param stop: The index of the frame to stop before, or None to replay all remaining frames.
+        """
+        capture.FrameSource.__init__(self, size)
+        self.reader = RecordingReader(directory)
+        self._index = start
+        self.stop = len(self.reader) if stop is None else min(stop, len(self.reader))
+
+    def frame_count(self):
+        return len(self.reader)
+
+    def _read_image(self):
+        if self._index >= self.stop:
+            return None, None
+        return np.array(self.reader.frame(self._index)), float(self.reader.timestamps[self._index])
+
+    def release(self):
+        self.reader.close()
+
+
+def is_recording(path):
+    """
+    Determines if a path is a recording directory.
+
+    :param path: The path to check.
+    """
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
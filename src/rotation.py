@@ -8,6 +8,7 @@ Utility methods and classes related to rotations.
 from __future__ import division  # so 1/2 returns 0.5 instead of 0
 from quaternion import Quaternion
 import cmath
+import collections
 import math
 import numpy as np
 import trig_tau
@@ -103,6 +104,72 @@ def unitary_breakdown(m):
     return pt.real, px.real, py.real, pz.real, p
 
 
+def unitary_breakdowns(ms):
+    """
+    Breaks a stack of 2x2 unitary matrices into components, like unitary_breakdown does for one matrix.
+    :param ms: An array of 2x2 unitary matrices, with shape (..., 2, 2).
+    :return: (components, phases) where components has shape (..., 4) and holds the real t, x, y and z components of
+    each matrix, and phases has shape (...) and holds the unit complex phase factors.
+
+    >>> ms = [Rotation().as_pauli_operation(), Rotation(y=0.25).as_pauli_operation(), np.mat([[0, 1], [1, 0]]) * 1j]
+    >>> components, phases = unitary_breakdowns(ms)
+    >>> all(np.allclose(list(components[i]) + [phases[i]], unitary_breakdown(np.mat(ms[i]))) for i in range(3))
+    True
+    """
+    ms = np.asarray(ms, np.complex128)
+    a, b, c, d = ms[..., 0, 0], ms[..., 0, 1], ms[..., 1, 0], ms[..., 1, 1]
+    components = np.stack([(a + d)/2j, (b + c)/2, (b - c)/-2j, (a - d)/2], axis=-1)
+
+    # The largest component (the first one, when tied) determines the phase factor
+    largest = np.argmax(np.abs(components), axis=-1)
+    phases = np.take_along_axis(components, largest[..., np.newaxis], axis=-1)[..., 0]
+    phases /= np.abs(phases)
+
+    return (components / phases[..., np.newaxis]).real, phases
+
+
+def unitary_lerps(u1s, u2s, ts):
+    """
+    Interpolates between stacks of pairs of 2x2 unitary matrices at several interpolation factors, like unitary_lerp.
+    :param u1s: The initial unitary operations, with shape (K, 2, 2).
+    :param u2s: The final unitary operations, with shape (K, 2, 2).
+    :param ts: The interpolation factors, with shape (T,).
+    :return: An array with shape (K, T, 2, 2), where entry [k, i] interpolates from u1s[k] to u2s[k] by ts[i].
+
+    >>> u1s = [Rotation().as_pauli_operation(), Rotation(x=0.5).as_pauli_operation(), np.identity(2)]
+    >>> u2s = [Rotation(x=0.75).as_pauli_operation(), Rotation(z=0.5).as_pauli_operation(), np.identity(2) * 1j]
+    >>> ts = [0, 0.25, 0.5, 1]
+    >>> results = unitary_lerps(u1s, u2s, ts)
+    >>> results.shape
+    (3, 4, 2, 2)
+    >>> all(np.allclose(results[k, i], unitary_lerp(u1s[k], u2s[k], ts[i])) for k in range(3) for i in range(4))
+    True
+    """
+    u1s, u2s = np.asarray(u1s, np.complex128), np.asarray(u2s, np.complex128)
+    ts = np.asarray(ts, np.float64)
+    q1, p1 = unitary_breakdowns(u1s)
+    q2, p2 = unitary_breakdowns(u2s)
+
+    # Spherical interpolation of rotation part, going the short way around
+    dot = np.sum(q1 * q2, axis=-1)
+    signs = np.where(dot < 0, -1, 1)
+    p2 = p2 * signs
+    dot = dot * signs
+    n1 = u1s / p1[:, np.newaxis, np.newaxis]
+    n2 = u2s / p2[:, np.newaxis, np.newaxis]
+    theta = np.arccos(np.clip(dot, -1, 1)) / trig_tau.tau
+    c1 = trig_tau.sin_scale_ratios(theta[:, np.newaxis], 1 - ts[np.newaxis, :])
+    c2 = trig_tau.sin_scale_ratios(theta[:, np.newaxis], ts[np.newaxis, :])
+    n3 = n1[:, np.newaxis] * c1[..., np.newaxis, np.newaxis] + n2[:, np.newaxis] * c2[..., np.newaxis, np.newaxis]
+
+    # Angular interpolation of phase part
+    phase_angle_1 = np.angle(p1)
+    phase_drift = (np.angle(p2) - phase_angle_1 + math.pi) % trig_tau.tau - math.pi
+    phase_angle_3 = phase_angle_1[:, np.newaxis] + phase_drift[:, np.newaxis] * ts[np.newaxis, :]
+
+    return n3 * np.exp(phase_angle_3 * 1j)[..., np.newaxis, np.newaxis]
+
+
 def unitary_lerp(u1, u2, t):
     """
     Continuously interpolates between 2x2 unitary matrices, with unitary intermediates.
@@ -135,42 +202,77 @@ def unitary_lerp(u1, u2, t):
             - Rotation(x=0.625).as_pauli_operation())) < 0.000001
     True
     """
-    t1, x1, y1, z1, p1 = unitary_breakdown(u1)
-    t2, x2, y2, z2, p2 = unitary_breakdown(u2)
-    n1 = u1/p1
-    n2 = u2/p2
-
-    # Spherical interpolation of rotation part
-    dot = Quaternion(t1, x1, y1, z1).dot(Quaternion(t2, x2, y2, z2))
-    if dot < 0:
-        p2 *= -1
-        n2 *= -1
-        dot *= -1
-    theta = trig_tau.acos(max(min(dot, 1), -1))
-    c1 = trig_tau.sin_scale_ratio(theta, 1-t)
-    c2 = trig_tau.sin_scale_ratio(theta, t)
-    n3 = (n1*c1 + n2*c2)
+    return UnitaryInterpolation(u1, u2).at(t)
 
-    # Angular interpolation of phase part
-    phase_angle_1 = cmath.log(p1).imag
-    phase_angle_2 = cmath.log(p2).imag
-    phase_drift = (phase_angle_2 - phase_angle_1 + math.pi) % trig_tau.tau - math.pi
-    phase_angle_3 = phase_angle_1 + phase_drift * t
-    p3 = cmath.exp(phase_angle_3 * 1j)
 
-    return n3 * p3
+class UnitaryInterpolation(object):
+    """
+    Continuously interpolates between two 2x2 unitary matrices, like unitary_lerp, but breaks the matrices down once
+    so that each interpolated matrix only costs a few multiplications.
+
+    >>> lerp = UnitaryInterpolation(Rotation().as_pauli_operation(), Rotation(x=0.5).as_pauli_operation())
+    >>> all((lerp.at(t) == unitary_lerp(Rotation().as_pauli_operation(), Rotation(x=0.5).as_pauli_operation(), t)) \
+            .all() for t in [0, 0.125, 0.5, 0.875, 1])
+    True
+    """
+
+    def __init__(self, u1, u2):
+        """
+        :param u1: The initial unitary operation, used at t=0.
+        :param u2: The final unitary operation, used at t=1.
+        """
+        t1, x1, y1, z1, p1 = unitary_breakdown(u1)
+        t2, x2, y2, z2, p2 = unitary_breakdown(u2)
+        n1 = u1/p1
+        n2 = u2/p2
+
+        # Spherical interpolation of rotation part
+        dot = Quaternion(t1, x1, y1, z1).dot(Quaternion(t2, x2, y2, z2))
+        if dot < 0:
+            p2 *= -1
+            n2 *= -1
+            dot *= -1
+        self._n1 = n1
+        self._n2 = n2
+        self._theta = trig_tau.acos(max(min(dot, 1), -1))
+
+        # Angular interpolation of phase part
+        self._phase_angle_1 = cmath.log(p1).imag
+        phase_angle_2 = cmath.log(p2).imag
+        self._phase_drift = (phase_angle_2 - self._phase_angle_1 + math.pi) % trig_tau.tau - math.pi
+
+    def at(self, t):
+        """
+        Returns the interpolated unitary matrix.
+        :param t: The interpolation factor, ranging from 0 to 1.
+        """
+        c1 = trig_tau.sin_scale_ratio(self._theta, 1-t)
+        c2 = trig_tau.sin_scale_ratio(self._theta, t)
+        n3 = (self._n1*c1 + self._n2*c2)
+
+        phase_angle_3 = self._phase_angle_1 + self._phase_drift * t
+        p3 = cmath.exp(phase_angle_3 * 1j)
+
+        return n3 * p3
 
 
 class Rotation(object):
     """
     Represents a rotation about some axis.
+
+    Rotations are compared via a canonical form computed once, at construction. Multiples of a quarter turn around the
+    X, Y or Z axis also get an exact small integer code, making comparing and hashing them as cheap as it is for ints.
     """
 
+    __slots__ = ('v', 'x', 'y', 'z', '_canonical', 'quarter_turn_code')
+
     def __init__(self, x=0.0, y=0.0, z=0.0):
         self.v = (x, y, z)
         self.x = x
         self.y = y
         self.z = z
+        self._canonical = self.__canonical()
+        self.quarter_turn_code = Rotation.__quarter_turn_code(self._canonical)
 
     def turns(self):
         """
@@ -231,6 +333,13 @@ class Rotation(object):
         >>> Rotation(x=0.25).then(Rotation(y=0.25)).then(Rotation(z=0.25))
         Y:¼
         """
+        key = (self.cache_key(), following_rotation.cache_key())
+        result = _GROUP_THEN.get(key)
+        if result is None:
+            result = _then_cache.get(key, lambda: self._then_uncached(following_rotation))
+        return result
+
+    def _then_uncached(self, following_rotation):
         return Rotation.from_quaternion(following_rotation.as_quaternion() * self.as_quaternion())
 
     def as_pauli_operation(self):
@@ -333,7 +442,20 @@ class Rotation(object):
         >>> np.all(abs(Rotation(x=-math.sqrt(0.125), z=-math.sqrt(0.125)).as_pauli_operation() \
                 - np.mat([[1, 1], [1, -1]]) / math.sqrt(2)) < 0.1 ** 14)
         True
+
+        # Results are shared between equal rotations, so they can't be modified
+        >>> Rotation(x=0.25).as_pauli_operation() is Rotation(x=-0.75).as_pauli_operation()
+        True
+        >>> Rotation(x=0.1).as_pauli_operation().flags.writeable
+        False
         """
+        key = self.cache_key()
+        result = _GROUP_PAULI_OPERATIONS.get(key)
+        if result is None:
+            result = _pauli_operation_cache.get(key, self._pauli_operation_uncached)
+        return result
+
+    def _pauli_operation_uncached(self):
         x, y, z = self.v
 
         s = math.copysign(1, 11*x + 13*y + 17*z)  # phase correction discontinuity on an awkward plane
@@ -349,7 +471,9 @@ class Rotation(object):
         else:
             cv = (1 - trig_tau.expi(s * theta)) / theta
 
-        return (np.identity(2) * ci + s * v * cv)/2
+        result = (np.identity(2) * ci + s * v * cv)/2
+        result.flags.writeable = False
+        return result
 
     def as_quaternion(self):
         """
@@ -389,6 +513,8 @@ class Rotation(object):
         # Preserves simple rotations
         >>> Rotation.from_quaternion(Quaternion(1)) == Rotation()
         True
+        >>> Rotation.from_quaternion(Quaternion(-1))
+        (no rotation)
         >>> Rotation.from_quaternion(Rotation(x=0.25).as_quaternion())
         X:¼
         >>> Rotation.from_quaternion(Rotation(x=-0.25).as_quaternion())
@@ -411,6 +537,9 @@ class Rotation(object):
         turns = 2*trig_tau.atan2(math.sqrt(q.x**2 + q.y**2 + q.z**2), q.w)
         smoothed_turns = smooth_near_quarter_turn(turns)
         d = trig_tau.sinc(smoothed_turns/2)/2
+        if d == 0:
+            # a full turn, which has no axis
+            return Rotation()
         x, y, z = q.x/d, q.y/d, q.z/d
         sx, sy, sz = smooth_near_quarter_turn(x), smooth_near_quarter_turn(y), smooth_near_quarter_turn(z)
         return Rotation(sx, sy, sz)
@@ -436,6 +565,38 @@ class Rotation(object):
 
         return t, x, y, z
 
+    @staticmethod
+    def __quarter_turn_code(canonical):
+        """
+        Returns 0 for no rotation, 3*axis+k for k quarter turns around the X (axis=0), Y (1) or Z (2) axis, and None for
+        all other rotations. Rotations with the same canonical form always get the same code.
+
+        >>> [Rotation(x=0.25).quarter_turn_code, Rotation(y=0.5).quarter_turn_code, Rotation(z=-0.25).quarter_turn_code]
+        [1, 5, 9]
+        >>> Rotation(x=1).quarter_turn_code, Rotation(x=0.6, y=0.8).quarter_turn_code
+        (0, 0)
+        >>> Rotation(x=0.1).quarter_turn_code is None, Rotation(x=0.5, y=0.5).quarter_turn_code is None
+        (True, True)
+        """
+        t, x, y, z = canonical
+        if t == 0:
+            return 0
+        quarters = t * 4
+        if quarters != int(quarters):
+            return None
+        for axis, unit in enumerate([(1, 0, 0), (0, 1, 0), (0, 0, 1)]):
+            if (x, y, z) == unit:
+                return axis * 3 + int(quarters) % 4
+        return None
+
+    def cache_key(self):
+        """
+        Returns a hashable value that is the same for rotations that are equal, and cheap to compare for quarter turns.
+        """
+        if self.quarter_turn_code is not None:
+            return self.quarter_turn_code
+        return self._canonical
+
     def __eq__(self, other):
         """
         >>> Rotation() == Rotation(x=1)
@@ -456,7 +617,10 @@ class Rotation(object):
         >>> Rotation(y=0.5) == Rotation(z=0.5)
         False
         """
-        return self.__canonical() == other.__canonical()
+        a, b = self.quarter_turn_code, other.quarter_turn_code
+        if a is not None or b is not None:
+            return a == b
+        return self._canonical == other._canonical
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -466,11 +630,16 @@ class Rotation(object):
         >>> Rotation(x=0.25).__hash__() == Rotation(x=-0.75).__hash__()
         True
         """
-        return self.__canonical().__hash__()
+        if self.quarter_turn_code is not None:
+            return self.quarter_turn_code
+        return self._canonical.__hash__()
 
     def __neg__(self):
         return Rotation(-self.x, -self.y, -self.z)
 
+    def __reduce__(self):
+        return Rotation, self.v
+
     def __repr__(self):
         """
         >>> Rotation()
@@ -542,3 +711,117 @@ class Rotation(object):
                 and next_rotation == prev_rotations[-2]:
             return prev_rotations[:-2] + [-next_rotation]
         return prev_rotations + [next_rotation]
+
+
+class LruCache(object):
+    """
+    Remembers the most recently used computed values, up to a fixed number of them.
+
+    >>> cache = LruCache(2)
+    >>> cache.get('a', lambda: 1), cache.get('b', lambda: 2), cache.get('a', lambda: 3)
+    (1, 2, 1)
+    >>> cache.get('c', lambda: 4), cache.get('b', lambda: 5), len(cache)
+    (4, 5, 2)
+    """
+
+    def __init__(self, max_size):
+        """
+        :param max_size: How many values to keep. The least recently used value is evicted when there are more.
+        """
+        self.max_size = max_size
+        self._values = collections.OrderedDict()
+
+    def get(self, key, compute):
+        """
+        Returns the remembered value for the given key, or computes and remembers it.
+
+        :param key: The hashable key the value is remembered by.
+        :param compute: A function without arguments returning the value, called when it isn't remembered.
+        """
+        if key in self._values:
+            value = self._values.pop(key)
+        else:
+            value = compute()
+            if len(self._values) >= self.max_size:
+                self._values.popitem(last=False)
+        self._values[key] = value
+        return value
+
+    def __len__(self):
+        return len(self._values)
+
+
+# How many results of rotating by arbitrary (i.e. not cube-group) rotations are remembered.
+CACHE_SIZE = 256
+
+_pauli_operation_cache = LruCache(CACHE_SIZE)
+_then_cache = LruCache(CACHE_SIZE)
+
+
+def quaternion_key(q):
+    """
+    Returns a hashable key that is the same for quaternions that rotate in the same way, as long as they are
+    axis-aligned (i.e. have components that are multiples of a half or of the square root of a half).
+
+    >>> quaternion_key(Rotation(x=0.5).as_quaternion()) == quaternion_key(-Rotation(x=0.5).as_quaternion())
+    True
+    """
+    key = tuple(int(round(c * 1000)) for c in [q.w, q.x, q.y, q.z])
+    # q and -q are the same rotation
+    return max(key, tuple(-c for c in key))
+
+
+def reach_all(start, generators, step, key=lambda e: e):
+    """
+    Finds everything reachable from a starting element by repeatedly applying generators. The search is breadth first,
+    so each element is reached by one of the shortest sequences of generators.
+
+    :param start: The element to start from.
+    :param generators: The generators that can be applied.
+    :param step: A function(element, generator) returning the element reached by applying the generator.
+    :param key: A function returning a hashable key that is the same for equivalent elements.
+    :return: A list of (element, word) pairs, in the order they were found, where word is the tuple of generator
+    indices that reaches the element from the start.
+
+    >>> reach_all(0, [1, 5], lambda e, g: (e + g) % 7)
+    [(0, ()), (1, (0,)), (5, (1,)), (2, (0, 0)), (6, (0, 1)), (3, (1, 1)), (4, (0, 1, 1))]
+    """
+    found = {key(start): (start, ())}
+    result = [found[key(start)]]
+    frontier = [result[0]]
+    while len(frontier) > 0:
+        next_frontier = []
+        for e, word in frontier:
+            for g, generator in enumerate(generators):
+                reached = step(e, generator)
+                k = key(reached)
+                if k not in found:
+                    found[k] = (reached, word + (g,))
+                    result.append(found[k])
+                    next_frontier.append(found[k])
+        frontier = next_frontier
+    return result
+
+
+def _cube_group():
+    """
+    Returns the 24 rotations that map an axis-aligned cube onto itself, reached by composing quarter turns.
+
+    >>> len(CUBE_GROUP)
+    24
+    """
+    def key(r):
+        return quaternion_key(r.as_quaternion())
+
+    # axis-aligned elements use the simplest representation of their rotation
+    simplest = {key(r): r for r in [Rotation(**{axis: t}) for axis in 'xyz' for t in [0.25, 0.5, 0.75]]}
+    reached = reach_all(Rotation(),
+                        [Rotation(x=0.25), Rotation(y=0.25), Rotation(z=0.25)],
+                        lambda r, q: r._then_uncached(q),
+                        key)
+    return [simplest.get(key(r), r) for r, _ in reached]
+
+CUBE_GROUP = _cube_group()
+
+_GROUP_PAULI_OPERATIONS = {r.cache_key(): r._pauli_operation_uncached() for r in CUBE_GROUP}
+_GROUP_THEN = {(a.cache_key(), b.cache_key()): a._then_uncached(b) for a in CUBE_GROUP for b in CUBE_GROUP}
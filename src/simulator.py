@@ -0,0 +1,333 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+A state vector simulator, applying controlled single qubit operations directly to the 2**n amplitudes of an n qubit
+state instead of building the operations' 2**n by 2**n matrices.
+
+Amplitudes are ordered the same way as the rows of gates.QuantumOperation.full_operation: bit w of an amplitude's index
+is the value of wire w, so wire 0 is the least significant bit.
+
+States can be batched, as a (B, 2**n) array of B states, to simulate a circuit on many inputs with one pass over the
+batch per gate.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import numpy as np
+from gates import QuantumOperation
+
+
+def zero_state(qubit_count):
+    """
+    Returns the state vector with every qubit off.
+
+    :param qubit_count: The number of qubits.
+
+    >>> zero_state(2).tolist()
+    [(1+0j), 0j, 0j, 0j]
+    """
+    state = np.zeros(1 << qubit_count, np.complex128)
+    state[0] = 1
+    return state
+
+
+def basis_states(qubit_count, indices):
+    """
+    Returns a batch of classical states, each with all of its amplitude on one basis state.
+
+    :param qubit_count: The number of qubits.
+    :param indices: The index of each state's basis state, e.g. 0b10 for wire 1 being on and wire 0 off.
+
+    >>> basis_states(2, [0, 3]).real.tolist()
+    [[1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0]]
+    """
+    states = np.zeros((len(indices), 1 << qubit_count), np.complex128)
+    states[np.arange(len(indices)), indices] = 1
+    return states
+
+
+def qubit_count(state):
+    """
+    Returns the number of qubits a state vector, or a batch of state vectors, has amplitudes for.
+
+    >>> qubit_count(zero_state(5)), qubit_count(basis_states(3, [0, 1]))
+    (5, 3)
+    """
+    size = state.shape[-1]
+    n = size.bit_length() - 1
+    if size != 1 << n:
+        raise ValueError("state vector length isn't a power of 2")
+    return n
+
+
+def apply_gate(state, single_qubit_operation, wire_index, wire_controls):
+    """
+    Applies a controlled single qubit operation to a state vector, or a batch of them, in place. Only the amplitudes
+    whose control bits are all on are touched, two at a time, so the work done is proportional to the size of the state.
+
+    :param state: A contiguous complex numpy array of 2**n amplitudes, or a (B, 2**n) batch of them. Modified in place.
+    :param single_qubit_operation: A 2x2 unitary matrix, or a (B, 2, 2) array of a matrix for each state in the batch.
+    :param wire_index: The wire the operation applies to.
+    :param wire_controls: For each wire, whether it controls the operation. The entry for wire_index is ignored.
+    :return: The given state.
+
+    >>> s = zero_state(3)
+    >>> apply_gate(s, np.mat([[0, 1], [1, 0]]), 1, [False, None, False]).tolist() == [0, 0, 1, 0, 0, 0, 0, 0]
+    True
+    >>> apply_gate(s, np.mat([[0, 1], [1, 0]]), 0, [None, True, False]).tolist() == [0, 0, 0, 1, 0, 0, 0, 0]
+    True
+    >>> apply_gate(s, np.mat([[0, 1], [1, 0]]), 2, [True, False, None]).tolist() == [0, 0, 0, 0, 0, 0, 0, 1]
+    True
+
+    # A different operation for each state in a batch
+    >>> b = basis_states(2, [0, 0, 2])
+    >>> apply_gate(b, [[[0, 1], [1, 0]], [[1, 0], [0, 1]], [[0, 1j], [1j, 0]]], 0, [None, False]).tolist() == \
+            [[0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1j]]
+    True
+    """
+    n = qubit_count(state)
+    batch_shape = state.shape[:-1]
+    amplitudes = state.reshape(batch_shape + (2,) * n)
+
+    # wire w is bit w of the index, i.e. axis n-1-w of the reshaped amplitudes (after the batch axes)
+    index = [slice(None)] * n
+    for w, is_control in enumerate(wire_controls):
+        if is_control and w != wire_index:
+            index[n - 1 - w] = 1
+    # the leading Ellipsis covers the batch axes, and keeps the result a view even when every wire axis is indexed
+    index[n - 1 - wire_index] = 0
+    off = amplitudes[(Ellipsis,) + tuple(index)]
+    index[n - 1 - wire_index] = 1
+    on = amplitudes[(Ellipsis,) + tuple(index)]
+
+    # per-state operations are broadcast over the remaining wire axes
+    m = np.asarray(single_qubit_operation)
+    m = m.reshape(m.shape[:-2] + (1,) * (off.ndim - (m.ndim - 2)) + (2, 2))
+    new_off = m[..., 0, 0] * off + m[..., 0, 1] * on
+    on *= m[..., 1, 1]
+    on += m[..., 1, 0] * off
+    off[...] = new_off
+    return state
+
+
+def apply_operation(state, operation):
+    """
+    Applies a gates.QuantumOperation to a state vector, or a batch of them, in place.
+
+    :param state: A contiguous complex numpy array of 2**n amplitudes, where n is the operation's number of wires, or a
+    (B, 2**n) batch of them.
+    :param operation: The gates.QuantumOperation to apply. Its single qubit operation may be a (B, 2, 2) array, to
+    apply a different matrix to each state in the batch.
+    :return: The given state.
+
+    >>> from rotation import Rotation
+    >>> ops = [QuantumOperation(Rotation(x=0.25).as_pauli_operation(), [None, False, True]), \
+               QuantumOperation(Rotation(y=0.5).as_pauli_operation(), [True, None, False]), \
+               QuantumOperation(np.mat([[2, 3], [5, 7]]), [True, True, None])]
+    >>> s, expected = zero_state(3), np.mat(zero_state(3)).T
+    >>> s[[0, 5]] = expected[[0, 5]] = np.sqrt(0.5)
+    >>> for op in ops:
+    ...     s, expected = apply_operation(s, op), op.full_operation() * expected
+    >>> np.allclose(s, expected.A1)
+    True
+    """
+    if len(operation.wire_controls) != qubit_count(state):
+        raise ValueError("operation doesn't have a wire for each qubit")
+    return apply_gate(state, operation.single_qubit_operation, operation.wire_index, operation.wire_controls)
+
+
+# The most wires a combined moment kernel may act on. Its matrix has 4**MAX_KERNEL_WIRES entries.
+MAX_KERNEL_WIRES = 4
+
+
+def operation_wires(operation):
+    """
+    Returns the wires an operation touches: its target wire followed by its control wires.
+
+    >>> operation_wires(QuantumOperation(np.mat([[0, 1], [1, 0]]), [True, False, None, True]))
+    [2, 0, 3]
+    """
+    return [operation.wire_index] + [w for w, is_control in enumerate(operation.wire_controls) if is_control]
+
+
+def _kernel_chunks(operations, max_wires):
+    chunks = []
+    chunk, wires = [], set()
+    for op in operations:
+        touched = set(operation_wires(op))
+        if len(chunk) > 0 and len(wires | touched) > max_wires:
+            chunks.append((chunk, wires))
+            chunk, wires = [], set()
+        chunk.append(op)
+        wires |= touched
+    if len(chunk) > 0:
+        chunks.append((chunk, wires))
+    return chunks
+
+
+def _apply_kernel(state, operations, wires):
+    """
+    Multiplies the operations, which touch only the given wires, into one matrix over those wires and applies it with
+    a single contraction over the state.
+    """
+    n = qubit_count(state)
+    wires = sorted(wires)
+    t = len(wires)
+    kernel = np.mat(np.identity(1 << t, np.complex128))
+    for op in operations:
+        controls = [None if w == op.wire_index else bool(op.wire_controls[w]) for w in wires]
+        kernel = QuantumOperation(op.single_qubit_operation, controls).full_operation() * kernel
+
+    # local bit j is wire wires[j], which is axis t-1-j of the kernel's tensor and axis n-1-wires[j] of the state's
+    # (after the batch axes)
+    batch_shape = state.shape[:-1]
+    axes = [len(batch_shape) + n - 1 - wires[t - 1 - a] for a in range(t)]
+    tensor = np.asarray(kernel).reshape((2,) * (2 * t))
+    result = np.tensordot(tensor, state.reshape(batch_shape + (2,) * n), axes=(list(range(t, 2 * t)), axes))
+    state[...] = np.moveaxis(result, list(range(t)), axes).reshape(state.shape)
+
+
+def apply_moment(state, operations, max_kernel_wires=MAX_KERNEL_WIRES):
+    """
+    Applies operations that touch disjoint sets of wires, and so can be applied in any order, to a state vector in
+    place. Operations are combined into kernels acting on up to max_kernel_wires wires, each applied in one pass over
+    the state, instead of making a pass per operation.
+
+    :param state: A contiguous complex numpy array of 2**n amplitudes, or a (B, 2**n) batch of them. Modified in place.
+    :param operations: The gates.QuantumOperation values to apply. No two may touch the same wire. Operations with a
+    (B, 2, 2) array of single qubit operations, one per state in the batch, are applied separately.
+    :param max_kernel_wires: The most wires a combined kernel may act on.
+    :return: The given state.
+
+    >>> from rotation import Rotation
+    >>> ops = [QuantumOperation(Rotation(x=0.25).as_pauli_operation(), [None, False, True, False, False]), \
+               QuantumOperation(Rotation(y=0.5).as_pauli_operation(), [False, None, False, False, True]), \
+               QuantumOperation(Rotation(z=0.25).as_pauli_operation(), [False, False, False, None, False])]
+    >>> s = np.arange(32) / np.linalg.norm(np.arange(32)) + 0j
+    >>> expected = reduce(apply_operation, ops, np.copy(s))
+    >>> np.allclose(apply_moment(np.copy(s), ops), expected), np.allclose(apply_moment(s, ops, 2), expected)
+    (True, True)
+    >>> batch = basis_states(5, range(32))
+    >>> np.allclose(apply_moment(np.copy(batch), ops), [reduce(apply_operation, ops, np.copy(b)) for b in batch])
+    True
+    """
+    batched = [op for op in operations if np.ndim(op.single_qubit_operation) > 2]
+    for op in batched:
+        apply_operation(state, op)
+    shared = [op for op in operations if np.ndim(op.single_qubit_operation) == 2]
+    for chunk, wires in _kernel_chunks(shared, max_kernel_wires):
+        if len(chunk) == 1:
+            apply_operation(state, chunk[0])
+        else:
+            _apply_kernel(state, chunk, wires)
+    return state
+
+
+def probabilities(state):
+    """
+    Returns the probability of measuring each basis state, for a state vector or each state in a batch.
+
+    :param state: An array of 2**n amplitudes, or a (B, 2**n) batch of them.
+
+    >>> probabilities(np.array([0.6, 0.8j, 0, 0])).round(6).tolist()
+    [0.36, 0.64, 0.0, 0.0]
+    """
+    p = np.abs(state) ** 2
+    return p / np.sum(p, axis=-1, keepdims=True)
+
+
+def marginal_probabilities(state):
+    """
+    Returns the probability of each wire being measured as on, for a state vector or each state in a batch.
+
+    :param state: An array of 2**n amplitudes, or a (B, 2**n) batch of them.
+    :return: An array with shape (n,), or (B, n) for a batch, indexed by wire.
+
+    >>> marginal_probabilities(np.array([0.6, 0.8, 0, 0])).round(6).tolist()
+    [0.64, 0.0]
+    """
+    n = qubit_count(state)
+    batch_shape = state.shape[:-1]
+    p = probabilities(state).reshape(batch_shape + (2,) * n)
+    b = len(batch_shape)
+    # wire w is axis n-1-w, after the batch axes
+    return np.stack([np.sum(p, axis=tuple(b + a for a in range(n) if a != n - 1 - w))[..., 1] for w in range(n)],
+                    axis=-1)
+
+
+def _random_state(random_state):
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    return np.random.RandomState(random_state)
+
+
+def sample(state, shots, random_state=None):
+    """
+    Simulates measuring every qubit of a state many times.
+
+    Probabilities are computed once and accumulated, and each state's shots are then drawn by searching its cumulative
+    probabilities for uniform random values, in one vectorized search per state.
+
+    :param state: An array of 2**n amplitudes, or a (B, 2**n) batch of them.
+    :param shots: How many measurements to simulate for each state.
+    :param random_state: A seed or np.random.RandomState, for reproducible results.
+    :return: An integer array with shape (shots,), or (B, shots) for a batch, of measured outcomes packed into
+    integers: bit w of an outcome is the value measured for wire w.
+
+    >>> sample(basis_states(2, [1, 2]), 3).tolist()
+    [[1, 1, 1], [2, 2, 2]]
+    >>> outcomes = sample(np.array([np.sqrt(0.25), 0, 0, np.sqrt(0.75)]), 100000, random_state=5)
+    >>> set(outcomes.tolist()), abs(np.mean(outcomes == 3) - 0.75) < 0.01
+    (set([0, 3]), True)
+    >>> sorted(set(sample(np.sqrt([0.2, 0.5, 0.3, 0]), 100000, random_state=5).tolist()))
+    [0, 1, 2]
+    """
+    p = probabilities(np.asarray(state))
+    batch_shape = p.shape[:-1]
+    size = p.shape[-1]
+    p = p.reshape(-1, size)
+    rows = p.shape[0]
+
+    cumulative = np.cumsum(p, axis=-1)
+    draws = _random_state(random_state).random_sample((rows, shots))
+    outcomes = np.empty((rows, shots), np.int64)
+    for i in range(rows):
+        # from the last possible outcome on, the total is 1 instead of slightly less due to rounding, so no draw can
+        # land on an impossible outcome
+        cumulative[i, np.flatnonzero(p[i])[-1]:] = 1
+        outcomes[i] = np.searchsorted(cumulative[i], draws[i], side='right')
+    return outcomes.reshape(batch_shape + (shots,))
+
+
+def sample_counts(state, shots, random_state=None):
+    """
+    Simulates measuring every qubit of a state many times, and counts how often each outcome happened.
+
+    :param state: An array of 2**n amplitudes, or a (B, 2**n) batch of them.
+    :param shots: How many measurements to simulate for each state.
+    :param random_state: A seed or np.random.RandomState, for reproducible results.
+    :return: An integer array with shape (2**n,), or (B, 2**n) for a batch, indexed by packed outcome (see sample).
+
+    >>> sample_counts(basis_states(2, [3, 0]), 10).tolist()
+    [[0, 0, 0, 10], [10, 0, 0, 0]]
+    """
+    outcomes = sample(state, shots, random_state)
+    size = np.shape(state)[-1]
+    rows = outcomes.reshape(-1, shots)
+    offsets = np.arange(rows.shape[0])[:, np.newaxis] * size
+    counts = np.bincount((rows + offsets).reshape(-1), minlength=rows.shape[0] * size)
+    return counts.reshape(outcomes.shape[:-1] + (size,))
+
+
+def wire_values(outcomes, wire_count):
+    """
+    Unpacks measured outcomes into the value measured for each wire.
+
+    :param outcomes: An integer array of packed outcomes, e.g. from sample.
+    :param wire_count: The number of wires.
+    :return: A boolean array with an extra last axis, indexed by wire.
+
+    >>> wire_values(np.array([1, 6]), 3).tolist()
+    [[True, False, False], [False, True, True]]
+    """
+    return (np.asarray(outcomes)[..., np.newaxis] >> np.arange(wire_count)) & 1 == 1
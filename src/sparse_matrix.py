@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""
+Sparse matrices for quantum operations over many wires, whose dense matrices would be too large to keep in memory.
+
+Uses SciPy's CSR matrices when SciPy is installed, and otherwise falls back to CsrMatrix, a minimal compressed sparse
+row format supporting just what operations need: products with other sparse matrices and with state vectors.
+"""
+
+from __future__ import division  # so 1/2 returns 0.5 instead of 0
+import numpy as np
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+class CsrMatrix(object):
+    """
+    A matrix stored in compressed sparse row form: the column indices and values of row i's non-zero entries are
+    indices[indptr[i]:indptr[i+1]] and data[indptr[i]:indptr[i+1]].
+
+    >>> a = CsrMatrix.from_entries([0, 0, 1], [0, 1, 1], [2, 3, 4], (2, 2))
+    >>> a.toarray().tolist()
+    [[2, 3], [0, 4]]
+    >>> (a * a).toarray().tolist(), a.nnz
+    ([[4, 18], [0, 16]], 3)
+    >>> (a * np.array([1, 10])).tolist()
+    [32, 40]
+    """
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = np.asarray(indptr, np.int64)
+        self.indices = np.asarray(indices, np.int64)
+        self.data = np.asarray(data)
+        self.shape = tuple(shape)
+
+    @staticmethod
+    def from_entries(rows, cols, values, shape):
+        """
+        Returns a matrix with the given entries. Entries at the same position are added together.
+
+        :param rows: The row index of each entry.
+        :param cols: The column index of each entry.
+        :param values: The value of each entry.
+        :param shape: The (row count, column count) of the matrix.
+        """
+        rows, cols, values = np.asarray(rows, np.int64), np.asarray(cols, np.int64), np.asarray(values)
+        keys, inverse = np.unique(rows * shape[1] + cols, return_inverse=True)
+        data = np.zeros(len(keys), values.dtype)
+        np.add.at(data, inverse, values)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(keys // shape[1], minlength=shape[0]))])
+        return CsrMatrix(indptr, keys % shape[1], data, shape)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def _rows(self):
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def dot(self, other):
+        """
+        Returns the product of this matrix and another CsrMatrix, or a dense vector or matrix.
+        """
+        if isinstance(other, CsrMatrix):
+            # row i of the product is the sum of other's rows k, scaled by self[i, k]
+            starts = other.indptr[self.indices]
+            counts = other.indptr[self.indices + 1] - starts
+            picked = np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)
+            return CsrMatrix.from_entries(np.repeat(self._rows(), counts),
+                                          other.indices[picked],
+                                          np.repeat(self.data, counts) * other.data[picked],
+                                          (self.shape[0], other.shape[1]))
+
+        other = np.asarray(other)
+        products = self.data.reshape((-1,) + (1,) * (other.ndim - 1)) * other[self.indices]
+        result = np.zeros((self.shape[0],) + other.shape[1:], products.dtype)
+        np.add.at(result, self._rows(), products)
+        return result
+
+    def __mul__(self, other):
+        return self.dot(other)
+
+    def toarray(self):
+        result = np.zeros(self.shape, self.data.dtype)
+        result[self._rows(), self.indices] = self.data
+        return result
+
+    def todense(self):
+        return np.mat(self.toarray())
+
+
+def from_entries(rows, cols, values, shape):
+    """
+    Returns a sparse matrix with the given entries, as a SciPy CSR matrix if SciPy is available and otherwise as a
+    CsrMatrix. Entries at the same position are added together.
+
+    :param rows: The row index of each entry.
+    :param cols: The column index of each entry.
+    :param values: The value of each entry.
+    :param shape: The (row count, column count) of the matrix.
+
+    >>> from_entries([1, 0, 1], [0, 1, 0], [2, 3, 4], (2, 3)).toarray().tolist()
+    [[0, 3, 0], [6, 0, 0]]
+    """
+    if scipy is None:
+        return CsrMatrix.from_entries(rows, cols, values, shape)
+    return scipy.sparse.csr_matrix((values, (rows, cols)), shape=shape)
+
+
+def identity(n, dtype=np.complex128):
+    """
+    Returns an n by n sparse identity matrix.
+
+    >>> identity(3).toarray().real.tolist()
+    [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+    """
+    return from_entries(np.arange(n), np.arange(n), np.ones(n, dtype), (n, n))
@@ -12,6 +12,7 @@ returns exactly 0.125 instead of an approximation of τ/8.
 
 from __future__ import division  # so 1/2 returns 0.5 instead of 0
 import math as math_rad
+import numpy as np
 
 
 tau = math_rad.pi * 2
@@ -91,6 +92,30 @@ def sin_scale_ratio(f, s):
     return sin(f * s) / sin(f)
 
 
+def sin_scale_ratios(f, s):
+    """
+    Returns the ratios sin(f s) / sin(f) for arrays of angles and scaling factors, like sin_scale_ratio.
+
+    :param f: An array of angle arguments, in fractions of a turn.
+    :param s: An array of scaling factors, broadcast against f.
+
+    >>> f, s = np.array([[0], [1/3], [0.0009], [0.00019]]), np.array([1/8, 1/4])
+    >>> np.allclose(sin_scale_ratios(f, s), [[sin_scale_ratio(a, b) for b in s] for a in f[:, 0]], rtol=0, atol=1e-13)
+    True
+    """
+    f, s = np.broadcast_arrays(np.asarray(f, np.float64), np.asarray(s, np.float64))
+    result = np.empty(f.shape)
+
+    # Near zero, switch to an approximation based on the first two Taylor series terms.
+    near = f < 0.0002
+    d = (tau * f[near]) ** 2 / 6
+    result[near] = s[near] * (1 - d * s[near] ** 2) / (1 - d)
+
+    far = ~near
+    result[far] = np.sin(tau * f[far] * s[far]) / np.sin(tau * f[far])
+    return result
+
+
 def cos(p):
     """
     Returns the cosine of the angle corresponding to a p'th of a turn.